@@ -0,0 +1,13 @@
+import os
+
+# Run with: gunicorn -c gunicorn_config.py src.main:app
+bind = os.environ.get('BIND', '0.0.0.0:5001')
+
+# Socket.IO needs a cooperative worker; Flask-SocketIO picks eventlet up automatically
+worker_class = 'eventlet'
+
+# Quiz rooms and joined sessions live in Redis and broadcasts go through its message queue,
+# so more than one worker needs REDIS_URL set (and sticky sessions at the proxy)
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+worker_connections = 1000
+keepalive = 5
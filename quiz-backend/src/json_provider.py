@@ -0,0 +1,43 @@
+import orjson
+from flask.json.provider import DefaultJSONProvider
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson, used by jsonify and request.get_json"""
+
+    def _options(self, indent=False, sort_keys=None):
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if self.sort_keys if sort_keys is None else sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return option
+
+    def dumps(self, obj, **kwargs):
+        # Fall back to Flask's handling of types orjson doesn't know (Decimal, __html__, ...)
+        option = self._options(kwargs.get('indent'), kwargs.get('sort_keys'))
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        # request.get_json passes the raw body bytes, which orjson parses without decoding
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        """jsonify without the bytes -> str -> bytes round-trip of the default provider"""
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        body = orjson.dumps(obj, default=self.default, option=self._options(indent) | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+class OrjsonModule:
+    """orjson behind the stdlib json dumps/loads signatures, for libraries that take a json module"""
+
+    @staticmethod
+    def dumps(obj, **kwargs):
+        # separators/indent hints from the caller are moot: orjson output is always compact
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    @staticmethod
+    def loads(s, **kwargs):
+        return orjson.loads(s)
@@ -1,11 +1,19 @@
 import os
 import sys
+import fcntl
+import hashlib
+from functools import lru_cache
 # DON'T CHANGE THIS !!!
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
+import sqlite3
+import click
 from flask import Flask, send_from_directory
 from flask_cors import CORS
-from src.models.user import db
+from sqlalchemy import event, inspect, text, select, func, case, delete
+from sqlalchemy.engine import Engine
+from src.models.user import db, UserSession, UserAnswer, GlobalStats, QuizAnalyticsRollup, QuestionAnalyticsRollup
+from src.json_provider import OrjsonProvider
 from src.routes.user import user_bp
 from src.routes.quiz import quiz_bp
 from src.routes.session import session_bp
@@ -14,6 +22,7 @@ from src.routes.websocket import init_socketio
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
+app.json = OrjsonProvider(app)
 
 # Enable CORS for all routes
 CORS(app, origins="*", supports_credentials=True)
@@ -28,13 +37,198 @@ app.register_blueprint(session_bp, url_prefix='/api')
 app.register_blueprint(image_bp, url_prefix='/api')
 
 # Database configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
+DATABASE_DIR = os.path.join(os.path.dirname(__file__), 'database')
+DATABASE_PATH = os.path.join(DATABASE_DIR, 'app.db')
+SCHEMA_SENTINEL = os.path.join(DATABASE_DIR, '.schema_initialized')
+DATABASE_URL = os.environ.get('DATABASE_URL')
+USING_SQLITE_FILE = DATABASE_URL is None
+app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL or f"sqlite:///{DATABASE_PATH}"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+if USING_SQLITE_FILE:
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_pre_ping': False,  # Local SQLite file, connections don't go stale
+        'pool_recycle': -1,
+        # SocketIO handlers run on other threads than the one that opened the connection
+        'connect_args': {'check_same_thread': False, 'timeout': 30}
+    }
+else:
+    # The pool is per worker process, so the DB's max_connections must cover
+    # gunicorn workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 25)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 25)),
+        # Seconds a request waits for a free connection before erroring out
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        'pool_pre_ping': True,
+        'pool_recycle': 1800
+    }
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file upload
 
+# Static file offload to the front proxy (both off for the dev server)
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes')
+app.config['IMAGES_ACCEL_REDIRECT_PREFIX'] = os.environ.get('IMAGES_ACCEL_REDIRECT_PREFIX')  # e.g. /_protected_images/
+
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Enable WAL so readers don't block on the writer"""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
 db.init_app(app)
-with app.app_context():
-    db.create_all()
+
+def sync_schema():
+    """Bring existing tables up to date with the models.
+
+    create_all skips tables that already exist, so add any nullable columns
+    and indexes that were declared after the database file was created.
+    Returns False while an index had to be skipped.
+    """
+    inspector = inspect(db.engine)
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                quote = db.engine.dialect.identifier_preparer.quote
+                connection.execute(text(
+                    f'ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} {column_type}'
+                ))
+
+    # Sessions created before token hashes existed
+    for session in UserSession.query.filter(UserSession.session_token_hash.is_(None)):
+        session.session_token_hash = UserSession.hash_token(session.session_token)
+    db.session.commit()
+
+    # Running answer counters start from the answers already recorded
+    if db.session.get(GlobalStats, GlobalStats.SINGLETON_ID) is None:
+        answers_total, answers_correct = db.session.execute(select(
+            func.count(UserAnswer.is_correct),
+            func.coalesce(func.sum(case((UserAnswer.is_correct == True, 1), else_=0)), 0)
+        )).one()
+        db.session.add(GlobalStats(
+            id=GlobalStats.SINGLETON_ID, answers_total=answers_total, answers_correct=answers_correct
+        ))
+        db.session.commit()
+
+    # Analytics roll-ups for quizzes/questions that predate them
+    QuizAnalyticsRollup.create_missing()
+    QuestionAnalyticsRollup.create_missing()
+    db.session.commit()
+
+    # Older databases may hold repeat answers that the unique (session, question) index would reject.
+    # Boot never deletes them: the index waits until `flask --app src.main dedupe-answers` has run
+    repeat_answers = count_repeat_answers()
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            if repeat_answers and index is UNIQUE_ANSWER_INDEX:
+                app.logger.error(
+                    f"Skipping index {index.name}: {repeat_answers} repeat answers; "
+                    f"run `flask --app src.main dedupe-answers` to remove them"
+                )
+                continue
+            index.create(bind=db.engine, checkfirst=True)
+
+    # Not fully synced until the unique answer index exists, so the next boot checks again
+    return not repeat_answers
+
+# Unique (session, question) index on answers, which older databases may hold duplicates for
+UNIQUE_ANSWER_INDEX = next(index for index in UserAnswer.__table__.indexes if index.unique)
+
+def repeat_answers_query():
+    """Ids of answers superseded by a later answer to the same question in the same session"""
+    latest_answers = select(func.max(UserAnswer.id)).group_by(UserAnswer.session_id, UserAnswer.question_id)
+    return select(UserAnswer.id).where(UserAnswer.id.not_in(latest_answers))
+
+def count_repeat_answers():
+    """How many answers the unique answer index would reject"""
+    return db.session.scalar(select(func.count()).select_from(repeat_answers_query().subquery()))
+
+@app.cli.command('dedupe-answers')
+def dedupe_answers():
+    """One-off migration: delete repeat answers (keeping each question's latest) and add the unique index"""
+    deleted = db.session.execute(
+        delete(UserAnswer).where(UserAnswer.id.in_(repeat_answers_query()))
+    ).rowcount
+    db.session.commit()
+    app.logger.warning(f"dedupe-answers deleted {deleted} repeat answers")
+    click.echo(f"Deleted {deleted} repeat answers")
+
+    UNIQUE_ANSWER_INDEX.create(bind=db.engine, checkfirst=True)
+    click.echo(f"Index {UNIQUE_ANSWER_INDEX.name} is in place")
+
+def schema_fingerprint():
+    """Digest of the declared tables, columns and indexes"""
+    parts = []
+    for table in db.metadata.sorted_tables:
+        parts.append(table.name)
+        parts.extend(f'{column.name}:{column.type}' for column in table.columns)
+        parts.extend(sorted(index.name for index in table.indexes))
+    return hashlib.sha256('|'.join(parts).encode()).hexdigest()
+
+def schema_is_current(fingerprint):
+    """Check the sentinel left by the last successful schema sync"""
+    if USING_SQLITE_FILE and not os.path.exists(DATABASE_PATH):
+        return False
+    if not os.path.exists(SCHEMA_SENTINEL):
+        return False
+    with open(SCHEMA_SENTINEL) as f:
+        return f.read().strip() == fingerprint
+
+def init_database():
+    """Create/upgrade the schema once per model change rather than once per worker"""
+    fingerprint = schema_fingerprint()
+    if schema_is_current(fingerprint):
+        return
+
+    # Workers booting together wait here; only the first one runs the DDL
+    with open(SCHEMA_SENTINEL + '.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            if schema_is_current(fingerprint):
+                return
+            with app.app_context():
+                db.create_all()
+                synced = sync_schema()
+            if synced:
+                with open(SCHEMA_SENTINEL, 'w') as f:
+                    f.write(fingerprint)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+init_database()
+
+def scan_static_files(static_folder_path):
+    """Collect relative paths (forward slashes) of all files in the static folder"""
+    files = set()
+    if static_folder_path is None:
+        return files
+    for root, _, filenames in os.walk(static_folder_path):
+        for filename in filenames:
+            rel_path = os.path.relpath(os.path.join(root, filename), static_folder_path)
+            files.add(rel_path.replace(os.sep, '/'))
+    return files
+
+# Built assets don't change while the server runs, so scan them once at startup
+_STATIC_FILES = scan_static_files(app.static_folder)
+_HAS_INDEX = 'index.html' in _STATIC_FILES
+_DEV_MODE = os.environ.get('FLASK_ENV') == 'development'
+
+@lru_cache(maxsize=4096)
+def is_static_file(path):
+    """Check whether a normalized request path is a known static file"""
+    return path in _STATIC_FILES
+
+def refresh_static_files():
+    """Rescan the static folder (development only, assets may be rebuilt)"""
+    global _STATIC_FILES, _HAS_INDEX
+    _STATIC_FILES = scan_static_files(app.static_folder)
+    _HAS_INDEX = 'index.html' in _STATIC_FILES
+    is_static_file.cache_clear()
 
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
@@ -43,11 +237,13 @@ def serve(path):
     if static_folder_path is None:
             return "Static folder not configured", 404
 
-    if path != "" and os.path.exists(os.path.join(static_folder_path, path)):
+    if _DEV_MODE:
+        refresh_static_files()
+
+    if path != "" and is_static_file(path):
         return send_from_directory(static_folder_path, path)
     else:
-        index_path = os.path.join(static_folder_path, 'index.html')
-        if os.path.exists(index_path):
+        if _HAS_INDEX:
             return send_from_directory(static_folder_path, 'index.html')
         else:
             return "index.html not found", 404
@@ -61,4 +257,5 @@ def internal_error(error):
     return {'success': False, 'error': {'message': 'Internal server error'}}, 500
 
 if __name__ == '__main__':
-    socketio.run(app, host='0.0.0.0', port=5001, debug=True)
+    # Development server only; production runs under gunicorn (see gunicorn_config.py)
+    socketio.run(app, host='0.0.0.0', port=5001, debug=os.environ.get('FLASK_ENV') == 'development')
@@ -1,10 +1,40 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import and_, or_, update, insert, select, case, exists, func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.hybrid import hybrid_method
+from sqlalchemy.orm import Bundle
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import check_password_hash
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHashError
+import calendar
+import hashlib
+import hmac
+import os
 import secrets
+import time
 
 db = SQLAlchemy()
 
+# Argon2id, defaulting to the OWASP minimum parameters (19 MiB, 2 passes); calibrate per host with the
+# ARGON2_* variables. Hashes made with other parameters are upgraded on the next successful login.
+password_hasher = PasswordHasher(
+    time_cost=int(os.environ.get('ARGON2_TIME_COST', 2)),
+    memory_cost=int(os.environ.get('ARGON2_MEMORY_COST', 19456)),
+    parallelism=int(os.environ.get('ARGON2_PARALLELISM', 1))
+)
+
+# Checked against when a login names an unknown user, so both paths cost one hash
+DUMMY_PASSWORD_HASH = password_hasher.hash(secrets.token_urlsafe(16))
+
+def dummy_check_password(password):
+    """Spend the same hashing work as a real password check, always fails"""
+    try:
+        password_hasher.verify(DUMMY_PASSWORD_HASH, password)
+    except VerificationError:
+        pass
+    return False
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
@@ -24,26 +54,43 @@ class User(db.Model):
 
     def set_password(self, password):
         """Hash and set password"""
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
         """Check if provided password matches hash"""
-        return check_password_hash(self.password_hash, password)
+        if not self.password_hash.startswith('$argon2'):
+            # Legacy werkzeug pbkdf2/scrypt hash
+            return check_password_hash(self.password_hash, password)
+        try:
+            return password_hasher.verify(self.password_hash, password)
+        except (VerificationError, InvalidHashError):
+            return False
+
+    def password_needs_rehash(self):
+        """Check if the stored hash is legacy or uses outdated argon2 parameters"""
+        if not self.password_hash.startswith('$argon2'):
+            return True
+        return password_hasher.check_needs_rehash(self.password_hash)
 
     def is_admin(self):
         """Check if user has admin role"""
         return self.role == 'admin'
 
-    def to_dict(self):
+    @staticmethod
+    def serialize(user):
+        """Build the user dict from anything exposing the user columns as attributes (instance or Row)"""
         return {
-            'id': self.id,
-            'username': self.username,
-            'email': self.email,
-            'role': self.role,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'is_active': self.is_active
+            'id': user.id,
+            'username': user.username,
+            'email': user.email,
+            'role': user.role,
+            'created_at': user.created_at.isoformat() if user.created_at else None,
+            'is_active': user.is_active
         }
 
+    def to_dict(self):
+        return User.serialize(self)
+
 class Quiz(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
@@ -58,41 +105,77 @@ class Quiz(db.Model):
     is_active = db.Column(db.Boolean, default=True)
     start_time = db.Column(db.DateTime)  # When quiz becomes available
     end_time = db.Column(db.DateTime)    # When quiz closes
+    version = db.Column(db.Integer, default=0)  # Bumped when questions change; keys the cached question list
     
     # Relationships
     questions = db.relationship('Question', backref='quiz', lazy=True, cascade='all, delete-orphan')
     sessions = db.relationship('UserSession', backref='quiz', lazy=True)
     results = db.relationship('QuizResult', backref='quiz', lazy=True)
 
+    __table_args__ = (
+        # Serves the availability filter on the quiz list
+        db.Index('ix_quiz_active_window', 'is_active', 'start_time', 'end_time'),
+    )
+
     def __repr__(self):
         return f'<Quiz {self.title}>'
 
-    def is_available(self):
-        """Check if quiz is currently available"""
-        now = datetime.utcnow()
-        if self.start_time and now < self.start_time:
+    @staticmethod
+    def check_available(is_active, start_time, end_time, now=None):
+        """Availability rule shared by ORM instances and plain result rows"""
+        if now is None:
+            now = datetime.utcnow()
+        if start_time and now < start_time:
             return False
-        if self.end_time and now > self.end_time:
+        if end_time and now > end_time:
             return False
-        return self.is_active
+        return is_active
 
-    def to_dict(self, include_questions=False):
-        data = {
-            'id': self.id,
-            'title': self.title,
-            'description': self.description,
-            'duration_minutes': self.duration_minutes,
-            'per_question_time_seconds': self.per_question_time_seconds,
-            'total_questions': self.total_questions,
-            'randomize_questions': self.randomize_questions,
-            'randomize_options': self.randomize_options,
-            'created_by': self.created_by,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'is_active': self.is_active,
-            'start_time': self.start_time.isoformat() if self.start_time else None,
-            'end_time': self.end_time.isoformat() if self.end_time else None,
-            'is_available': self.is_available()
+    @staticmethod
+    def bump_version(quiz_id, **values):
+        """Move a quiz to a new version (so cached question lists are skipped), along with any other column values"""
+        db.session.execute(
+            update(Quiz).where(Quiz.id == quiz_id).values(version=func.coalesce(Quiz.version, 0) + 1, **values)
+        )
+
+    @hybrid_method
+    def is_available(self, now=None):
+        """Check if quiz is currently available"""
+        return Quiz.check_available(self.is_active, self.start_time, self.end_time, now)
+
+    @is_available.expression
+    def is_available(cls, now=None):
+        """SQL form of the availability rule, usable in WHERE clauses"""
+        if now is None:
+            now = datetime.utcnow()
+        return and_(
+            cls.is_active == True,
+            or_(cls.start_time == None, cls.start_time <= now),
+            or_(cls.end_time == None, cls.end_time >= now)
+        )
+
+    @staticmethod
+    def serialize(quiz):
+        """Build the quiz dict from anything exposing the quiz columns as attributes (instance or Row)"""
+        return {
+            'id': quiz.id,
+            'title': quiz.title,
+            'description': quiz.description,
+            'duration_minutes': quiz.duration_minutes,
+            'per_question_time_seconds': quiz.per_question_time_seconds,
+            'total_questions': quiz.total_questions,
+            'randomize_questions': quiz.randomize_questions,
+            'randomize_options': quiz.randomize_options,
+            'created_by': quiz.created_by,
+            'created_at': quiz.created_at.isoformat() if quiz.created_at else None,
+            'is_active': quiz.is_active,
+            'start_time': quiz.start_time.isoformat() if quiz.start_time else None,
+            'end_time': quiz.end_time.isoformat() if quiz.end_time else None,
+            'is_available': Quiz.check_available(quiz.is_active, quiz.start_time, quiz.end_time)
         }
+
+    def to_dict(self, include_questions=False):
+        data = Quiz.serialize(self)
         
         if include_questions:
             data['questions'] = [q.to_dict() for q in self.questions]
@@ -100,8 +183,13 @@ class Quiz(db.Model):
         return data
 
 class Question(db.Model):
+    __table_args__ = (
+        # get_current_question reads a quiz's question ids in (question_order, id) order from this index
+        db.Index('ix_question_quiz_order', 'quiz_id', 'question_order', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), nullable=False)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), nullable=False, index=True)
     question_text = db.Column(db.Text, nullable=False)
     question_image_path = db.Column(db.String(255))  # Generated image path
     option_a = db.Column(db.String(500), nullable=False)
@@ -128,28 +216,54 @@ class Question(db.Model):
             'd': self.option_d
         }
 
-    def to_dict(self, include_correct_answer=False):
+    @staticmethod
+    def serialize(question, include_correct_answer=False):
+        """Build the question dict from anything exposing the question columns as attributes (instance or Row)"""
         data = {
-            'id': self.id,
-            'quiz_id': self.quiz_id,
-            'question_text': self.question_text,
-            'question_image_path': self.question_image_path,
-            'options': self.get_options(),
-            'options_image_path': self.options_image_path,
-            'question_order': self.question_order,
-            'time_bonus_factor': self.time_bonus_factor
+            'id': question.id,
+            'quiz_id': question.quiz_id,
+            'question_text': question.question_text,
+            'question_image_path': question.question_image_path,
+            'options': {
+                'a': question.option_a,
+                'b': question.option_b,
+                'c': question.option_c,
+                'd': question.option_d
+            },
+            'options_image_path': question.options_image_path,
+            'question_order': question.question_order,
+            'time_bonus_factor': question.time_bonus_factor
         }
         
         if include_correct_answer:
-            data['correct_answer'] = self.correct_answer
+            data['correct_answer'] = question.correct_answer
             
         return data
 
+    def to_dict(self, include_correct_answer=False):
+        return Question.serialize(self, include_correct_answer)
+
 class UserSession(db.Model):
+    __table_args__ = (
+        # start_quiz looks for a user's open session on a quiz
+        db.Index('ix_user_session_user_quiz_open', 'user_id', 'quiz_id', 'is_completed'),
+        # Admin stats count distinct recent users straight from this index
+        db.Index('ix_user_session_start_user', 'start_time', 'user_id'),
+        # Active-session list filtered by quiz, and per-quiz attempt counts
+        db.Index('ix_user_session_quiz_completed', 'quiz_id', 'is_completed'),
+        # Partial index over open sessions only: the admin active list pages and counts from it
+        # without touching the completed history, which is most of the table
+        db.Index(
+            'ix_user_session_open', 'is_completed', 'id',
+            sqlite_where=db.text('is_completed = 0'), postgresql_where=db.text('is_completed = false')
+        ),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), nullable=False)
-    session_token = db.Column(db.String(255), unique=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), nullable=False, index=True)
+    session_token = db.Column(db.String(255), nullable=False)
+    session_token_hash = db.Column(db.String(64), unique=True, index=True)  # sha256 of session_token, used for lookups
     start_time = db.Column(db.DateTime, default=datetime.utcnow)
     end_time = db.Column(db.DateTime)
     current_question_index = db.Column(db.Integer, default=0)
@@ -166,48 +280,103 @@ class UserSession(db.Model):
         super(UserSession, self).__init__(**kwargs)
         if not self.session_token:
             self.session_token = secrets.token_urlsafe(32)
+        self.session_token_hash = self.hash_token(self.session_token)
 
     def __repr__(self):
         return f'<UserSession {self.session_token}>'
 
-    def is_active(self):
-        """Check if session is still active"""
-        if self.is_completed:
+    @staticmethod
+    def hash_token(token):
+        """Fixed-size digest of a session token used as the lookup key"""
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    @classmethod
+    def get_by_token(cls, token, user_id=None):
+        """Find a session by token (and owner, if given), comparing the token itself in constant time"""
+        if not token:
+            return None
+        query = cls.query.filter_by(session_token_hash=cls.hash_token(token))
+        if user_id is not None:
+            query = query.filter_by(user_id=user_id)
+        session = query.first()
+        if session and hmac.compare_digest(session.session_token, token):
+            return session
+        return None
+
+    @staticmethod
+    def check_active(is_completed, end_time):
+        """Activity rule shared by ORM instances and plain result rows"""
+        if is_completed:
             return False
-        if self.end_time and datetime.utcnow() > self.end_time:
+        if end_time and datetime.utcnow() > end_time:
             return False
         return True
 
-    def calculate_time_remaining(self):
-        """Calculate remaining time for the session"""
-        if not self.quiz or self.is_completed:
+    @staticmethod
+    def to_epoch(value):
+        """Naive UTC datetime as epoch seconds"""
+        return calendar.timegm(value.utctimetuple()) if value else None
+
+    @staticmethod
+    def remaining_seconds(start_epoch, duration_minutes, is_completed):
+        """Seconds left on the quiz clock for a session started at start_epoch"""
+        if is_completed or start_epoch is None:
             return 0
-        
-        elapsed = (datetime.utcnow() - self.start_time).total_seconds()
-        total_time = self.quiz.duration_minutes * 60
-        remaining = max(0, total_time - elapsed)
-        
-        self.time_remaining = int(remaining)
+        return int(max(0, duration_minutes * 60 - (time.time() - start_epoch)))
+
+    def is_active(self):
+        """Check if session is still active"""
+        return UserSession.check_active(self.is_completed, self.end_time)
+
+    @property
+    def start_epoch(self):
+        """start_time as UTC epoch seconds, cached per instance"""
+        cached = getattr(self, '_start_epoch_cache', None)
+        if cached is None or cached[0] != self.start_time:
+            epoch = UserSession.to_epoch(self.start_time)
+            cached = (self.start_time, epoch)
+            self._start_epoch_cache = cached
+        return cached[1]
+
+    def get_time_remaining(self):
+        """Compute remaining time for the session without touching the row"""
+        if not self.quiz:
+            return 0
+        return UserSession.remaining_seconds(self.start_epoch, self.quiz.duration_minutes, self.is_completed)
+
+    def calculate_time_remaining(self):
+        """Calculate remaining time for the session and store it on the row"""
+        self.time_remaining = self.get_time_remaining()
         return self.time_remaining
 
-    def to_dict(self):
+    @staticmethod
+    def serialize(session, time_remaining):
+        """Build the session dict from anything exposing the session columns as attributes (instance or Row)"""
         return {
-            'id': self.id,
-            'user_id': self.user_id,
-            'quiz_id': self.quiz_id,
-            'session_token': self.session_token,
-            'start_time': self.start_time.isoformat() if self.start_time else None,
-            'end_time': self.end_time.isoformat() if self.end_time else None,
-            'current_question_index': self.current_question_index,
-            'time_remaining': self.calculate_time_remaining(),
-            'is_completed': self.is_completed,
-            'is_active': self.is_active()
+            'id': session.id,
+            'user_id': session.user_id,
+            'quiz_id': session.quiz_id,
+            'session_token': session.session_token,
+            'start_time': session.start_time.isoformat() if session.start_time else None,
+            'end_time': session.end_time.isoformat() if session.end_time else None,
+            'current_question_index': session.current_question_index,
+            'time_remaining': time_remaining,
+            'is_completed': session.is_completed,
+            'is_active': UserSession.check_active(session.is_completed, session.end_time)
         }
 
+    def to_dict(self):
+        return UserSession.serialize(self, self.get_time_remaining())
+
 class UserAnswer(db.Model):
+    __table_args__ = (
+        # One answer per question per session; also the conflict target of the submit upsert
+        db.Index('uq_user_answer_session_question', 'session_id', 'question_id', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    session_id = db.Column(db.Integer, db.ForeignKey('user_session.id'), nullable=False)
-    question_id = db.Column(db.Integer, db.ForeignKey('question.id'), nullable=False)
+    session_id = db.Column(db.Integer, db.ForeignKey('user_session.id'), nullable=False, index=True)
+    question_id = db.Column(db.Integer, db.ForeignKey('question.id'), nullable=False, index=True)
     selected_answer = db.Column(db.String(1))  # 'a', 'b', 'c', 'd' or null if unanswered
     time_taken_seconds = db.Column(db.Integer)
     answered_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -224,22 +393,136 @@ class UserAnswer(db.Model):
             self.is_correct = False
         return self.is_correct
 
-    def to_dict(self):
+    @classmethod
+    def record(cls, session_id, quiz_id, question_id, selected_answer, time_taken):
+        """Insert or overwrite a session's answer and move the answer counters; None if the question isn't in the quiz"""
+        # Verify question belongs to the quiz, reading any earlier answer in the same query
+        question = db.session.execute(
+            select(
+                Question.id,
+                Question.correct_answer,
+                cls.id.label('answer_id'),
+                cls.is_correct,
+                cls.time_taken_seconds
+            ).outerjoin(cls, and_(
+                cls.question_id == Question.id,
+                cls.session_id == session_id
+            )).where(Question.id == question_id, Question.quiz_id == quiz_id)
+        ).first()
+        if question is None:
+            return None
+        
+        is_correct = selected_answer is not None and selected_answer == question.correct_answer
+        previous = (question.is_correct, question.time_taken_seconds) if question.answer_id is not None else None
+        
+        # Insert or overwrite the answer in one statement
+        answer = db.session.execute(
+            upsert(
+                cls,
+                {
+                    'session_id': session_id,
+                    'question_id': question.id,
+                    'selected_answer': selected_answer,
+                    'time_taken_seconds': time_taken,
+                    'answered_at': datetime.utcnow(),
+                    'is_correct': is_correct
+                },
+                conflict_columns=['session_id', 'question_id'],
+                update_columns=['selected_answer', 'time_taken_seconds', 'answered_at', 'is_correct']
+            ).returning(*cls.__table__.columns)
+        ).one()
+        
+        GlobalStats.record_answer(previous[0] if previous else None, is_correct)
+        QuestionAnalyticsRollup.record_answer(question.id, previous, (is_correct, time_taken))
+        return answer
+
+    @classmethod
+    def record_many(cls, answers):
+        """Bulk record() for dicts of session_id, quiz_id, question_id, selected_answer and time_taken
+
+        At most one answer per (session, question). Answers to questions outside their quiz, or for
+        sessions already completed, are skipped; returns how many were written.
+        """
+        # Answers that land after the result was computed must not change it or the rollups
+        session_ids = set(db.session.scalars(
+            select(UserSession.id).where(
+                UserSession.id.in_({answer['session_id'] for answer in answers}), UserSession.is_completed == False
+            )
+        ))
+        answers = [answer for answer in answers if answer['session_id'] in session_ids]
+        question_ids = {answer['question_id'] for answer in answers}
+        questions = {
+            row.id: row for row in db.session.execute(
+                select(Question.id, Question.quiz_id, Question.correct_answer).where(Question.id.in_(question_ids))
+            )
+        }
+        previous_answers = {
+            (row.session_id, row.question_id): (row.is_correct, row.time_taken_seconds) for row in db.session.execute(
+                select(cls.session_id, cls.question_id, cls.is_correct, cls.time_taken_seconds).where(
+                    cls.session_id.in_(session_ids), cls.question_id.in_(question_ids)
+                )
+            )
+        }
+        
+        rows = []
+        total_delta = correct_delta = 0
+        question_deltas = {}
+        now = datetime.utcnow()
+        for answer in answers:
+            question = questions.get(answer['question_id'])
+            if question is None or question.quiz_id != answer['quiz_id']:
+                continue
+            selected_answer = answer['selected_answer']
+            is_correct = selected_answer is not None and selected_answer == question.correct_answer
+            previous = previous_answers.get((answer['session_id'], question.id))
+            rows.append({
+                'session_id': answer['session_id'],
+                'question_id': question.id,
+                'selected_answer': selected_answer,
+                'time_taken_seconds': answer['time_taken'],
+                'answered_at': now,
+                'is_correct': is_correct
+            })
+            total, correct = GlobalStats.answer_deltas(previous[0] if previous else None, is_correct)
+            total_delta += total
+            correct_delta += correct
+            QuestionAnalyticsRollup.answer_deltas(
+                question_deltas.setdefault(question.id, {}), previous, (is_correct, answer['time_taken'])
+            )
+        
+        if rows:
+            # One multi-row upsert, then one counter UPDATE per question touched
+            db.session.execute(upsert(
+                cls, rows,
+                conflict_columns=['session_id', 'question_id'],
+                update_columns=['selected_answer', 'time_taken_seconds', 'answered_at', 'is_correct']
+            ))
+            GlobalStats.increment(total_delta, correct_delta)
+            for question_id, deltas in question_deltas.items():
+                QuestionAnalyticsRollup.increment(question_id, deltas)
+        return len(rows)
+
+    @staticmethod
+    def serialize(answer):
+        """Build the answer dict from anything exposing the answer columns as attributes (instance or Row)"""
         return {
-            'id': self.id,
-            'session_id': self.session_id,
-            'question_id': self.question_id,
-            'selected_answer': self.selected_answer,
-            'time_taken_seconds': self.time_taken_seconds,
-            'answered_at': self.answered_at.isoformat() if self.answered_at else None,
-            'is_correct': self.is_correct
+            'id': answer.id,
+            'session_id': answer.session_id,
+            'question_id': answer.question_id,
+            'selected_answer': answer.selected_answer,
+            'time_taken_seconds': answer.time_taken_seconds,
+            'answered_at': answer.answered_at.isoformat() if answer.answered_at else None,
+            'is_correct': answer.is_correct
         }
 
+    def to_dict(self):
+        return UserAnswer.serialize(self)
+
 class QuizResult(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    session_id = db.Column(db.Integer, db.ForeignKey('user_session.id'), nullable=False)
+    session_id = db.Column(db.Integer, db.ForeignKey('user_session.id'), nullable=False, index=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), nullable=False)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), nullable=False, index=True)
     total_score = db.Column(db.Float, default=0.0)
     accuracy_score = db.Column(db.Integer, default=0)  # Correct answers count
     time_bonus_score = db.Column(db.Float, default=0.0)
@@ -254,31 +537,41 @@ class QuizResult(db.Model):
 
     def calculate_scores(self):
         """Calculate all scores based on session answers"""
-        if not self.session or not self.session.answers:
+        if not self.session:
             return
         
-        answers = self.session.answers
-        total_questions = len(self.session.quiz.questions)
+        max_time = 30  # Maximum time for full bonus
+        
+        # Bonus for answering quickly (0.1 point per second saved from 30 seconds), scaled by the question's factor
+        time_saved = case((UserAnswer.time_taken_seconds < max_time, max_time - UserAnswer.time_taken_seconds), else_=0)
+        answer_bonus = case(
+            (and_(UserAnswer.is_correct == True, UserAnswer.time_taken_seconds != 0),
+             time_saved * 0.1 * func.coalesce(Question.time_bonus_factor, 1.0)),
+            else_=0
+        )
         
-        # Count correct answers and calculate accuracy
-        correct_count = sum(1 for answer in answers if answer.is_correct)
-        attempted_count = sum(1 for answer in answers if answer.selected_answer is not None)
+        # Score every answer in one aggregate query
+        answer_count, attempted_count, correct_count, time_bonus = db.session.execute(
+            select(
+                func.count(UserAnswer.id),
+                func.coalesce(count_where(UserAnswer.selected_answer.isnot(None)), 0),
+                func.coalesce(count_where(UserAnswer.is_correct == True), 0),
+                func.coalesce(func.sum(answer_bonus), 0.0)
+            ).join(Question, UserAnswer.question_id == Question.id).where(
+                UserAnswer.session_id == self.session_id
+            )
+        ).one()
+        
+        if not answer_count:
+            return
+        
+        total_questions = self.session.quiz.total_questions or 0
         
         self.accuracy_score = correct_count
         self.questions_attempted = attempted_count
         self.questions_correct = correct_count
         self.completion_percentage = (attempted_count / total_questions * 100) if total_questions > 0 else 0
         
-        # Calculate time bonus
-        time_bonus = 0.0
-        for answer in answers:
-            if answer.is_correct and answer.time_taken_seconds:
-                # Bonus for answering quickly (0.1 point per second saved from 30 seconds)
-                max_time = 30  # Maximum time for full bonus
-                time_saved = max(0, max_time - answer.time_taken_seconds)
-                bonus_factor = answer.question.time_bonus_factor if answer.question else 1.0
-                time_bonus += time_saved * 0.1 * bonus_factor
-        
         self.time_bonus_score = time_bonus
         self.total_score = self.accuracy_score + self.time_bonus_score
         
@@ -286,6 +579,10 @@ class QuizResult(db.Model):
         if self.session.start_time and self.session.end_time:
             self.total_time_taken = int((self.session.end_time - self.session.start_time).total_seconds())
 
+    def rollup_values(self):
+        """What this result contributes to QuizAnalyticsRollup"""
+        return (self.total_score, self.total_time_taken, self.completion_percentage)
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -302,6 +599,279 @@ class QuizResult(db.Model):
             'submitted_at': self.submitted_at.isoformat() if self.submitted_at else None
         }
 
+# Dialects whose INSERT supports ON CONFLICT ... DO UPDATE
+UPSERT_INSERTS = {
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert
+}
+
+def upsert(model, values, conflict_columns, update_columns):
+    """INSERT ... ON CONFLICT (conflict_columns) DO UPDATE update_columns, for the bound database
+
+    values is one row's dict, or a list of them for a multi-row upsert (at most one per conflict key).
+    """
+    dialect = db.session.get_bind().dialect.name
+    statement = UPSERT_INSERTS[dialect](model).values(values)
+    return statement.on_conflict_do_update(
+        index_elements=conflict_columns,
+        set_={column: statement.excluded[column] for column in update_columns}
+    )
+
+class ColumnBundle(Bundle):
+    """Bundle whose rows keep each column's own name, even when it collides with another bundle's"""
+
+    def create_row_processor(self, query, procs, labels):
+        return super().create_row_processor(query, procs, [column.key for column in self.exprs])
+
+def count_where(condition):
+    """SUM(CASE WHEN condition THEN 1 ELSE 0 END)"""
+    return func.sum(case((condition, 1), else_=0))
+
+def add_deltas(deltas, values, sign):
+    """Accumulate sign * values (a {column: amount} dict) into deltas"""
+    for name, amount in values.items():
+        deltas[name] = deltas.get(name, 0) + sign * amount
+
+def increment_row(key_column, key, deltas):
+    """Atomically add deltas to one row's counters; False if there is no such row"""
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return True
+    model = key_column.class_
+    result = db.session.execute(
+        update(model).where(key_column == key).values(
+            **{name: getattr(model, name) + delta for name, delta in deltas.items()}
+        )
+    )
+    return result.rowcount > 0
+
+class QuizAnalyticsRollup(db.Model):
+    """Running per-quiz analytics totals, kept current as sessions start and get submitted"""
+    # (label, column, upper bound of completion_percentage)
+    SCORE_BUCKETS = (
+        ('0-25%', 'bucket_0_25', 25),
+        ('26-50%', 'bucket_26_50', 50),
+        ('51-75%', 'bucket_51_75', 75),
+        ('76-100%', 'bucket_76_100', None)
+    )
+
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), primary_key=True)
+    total_attempts = db.Column(db.Integer, default=0, nullable=False)
+    completed_attempts = db.Column(db.Integer, default=0, nullable=False)
+    results_count = db.Column(db.Integer, default=0, nullable=False)
+    sum_score = db.Column(db.Float, default=0.0, nullable=False)
+    sum_time = db.Column(db.BigInteger, default=0, nullable=False)  # Only results with a non-zero time
+    count_time = db.Column(db.Integer, default=0, nullable=False)
+    bucket_0_25 = db.Column(db.Integer, default=0, nullable=False)
+    bucket_26_50 = db.Column(db.Integer, default=0, nullable=False)
+    bucket_51_75 = db.Column(db.Integer, default=0, nullable=False)
+    bucket_76_100 = db.Column(db.Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return f'<QuizAnalyticsRollup {self.quiz_id}>'
+
+    @classmethod
+    def score_bucket(cls, completion_percentage):
+        """Name of the bucket column a completion percentage falls into"""
+        for _, column, upper in cls.SCORE_BUCKETS:
+            if upper is None or completion_percentage <= upper:
+                return column
+
+    @classmethod
+    def increment(cls, quiz_id, **deltas):
+        """Add deltas to a quiz's counters; a missing row is rebuilt from the base tables instead"""
+        if not increment_row(cls.quiz_id, quiz_id, deltas):
+            db.session.flush()
+            cls.create_missing(quiz_id)
+
+    @classmethod
+    def record_result(cls, quiz_id, previous, current):
+        """Swap one result's contribution; previous/current are QuizResult.rollup_values() or None"""
+        deltas = {}
+        for values, sign in ((previous, -1), (current, 1)):
+            if values is None:
+                continue
+            total_score, total_time_taken, completion_percentage = values
+            add_deltas(deltas, {
+                'results_count': 1,
+                'sum_score': total_score or 0,
+                'sum_time': total_time_taken or 0,
+                'count_time': 1 if total_time_taken else 0,
+                cls.score_bucket(completion_percentage or 0): 1
+            }, sign)
+        cls.increment(quiz_id, **deltas)
+
+    @classmethod
+    def create_missing(cls, quiz_id=None):
+        """Insert rows computed from sessions and results for quizzes that have none"""
+        sessions = select(
+            UserSession.quiz_id,
+            func.count(UserSession.id).label('total_attempts'),
+            count_where(UserSession.is_completed == True).label('completed_attempts')
+        ).group_by(UserSession.quiz_id)
+        nonzero_time = func.nullif(QuizResult.total_time_taken, 0)
+        bucket_conditions = []
+        lower = None
+        for _, column, upper in cls.SCORE_BUCKETS:
+            bounds = []
+            if lower is not None:
+                bounds.append(QuizResult.completion_percentage > lower)
+            if upper is not None:
+                bounds.append(QuizResult.completion_percentage <= upper)
+            bucket_conditions.append(count_where(and_(*bounds)).label(column))
+            lower = upper
+        results = select(
+            QuizResult.quiz_id,
+            func.count(QuizResult.id).label('results_count'),
+            func.sum(QuizResult.total_score).label('sum_score'),
+            func.sum(nonzero_time).label('sum_time'),
+            func.count(nonzero_time).label('count_time'),
+            *bucket_conditions
+        ).group_by(QuizResult.quiz_id)
+        if quiz_id is not None:
+            # Aggregate just this quiz's rows; the outer filter alone isn't pushed into the GROUP BYs
+            sessions = sessions.where(UserSession.quiz_id == quiz_id)
+            results = results.where(QuizResult.quiz_id == quiz_id)
+        sessions = sessions.subquery()
+        results = results.subquery()
+
+        columns = ['quiz_id', 'total_attempts', 'completed_attempts', 'results_count', 'sum_score',
+                   'sum_time', 'count_time'] + [column for _, column, _ in cls.SCORE_BUCKETS]
+        source = {**sessions.c, **results.c}
+        query = select(
+            Quiz.id,
+            *(func.coalesce(source[name], 0) for name in columns[1:])
+        ).select_from(Quiz).outerjoin(
+            sessions, sessions.c.quiz_id == Quiz.id
+        ).outerjoin(
+            results, results.c.quiz_id == Quiz.id
+        ).where(~exists().where(cls.quiz_id == Quiz.id))
+        if quiz_id is not None:
+            query = query.where(Quiz.id == quiz_id)
+        db.session.execute(insert(cls).from_select(columns, query))
+
+    def to_dict(self):
+        return {
+            'total_attempts': self.total_attempts,
+            'completed_attempts': self.completed_attempts,
+            'completion_rate': (self.completed_attempts / self.total_attempts * 100) if self.total_attempts else 0,
+            'average_score': self.sum_score / self.results_count if self.results_count else 0,
+            'average_time': self.sum_time / self.count_time if self.count_time else 0,
+            'score_distribution': {label: getattr(self, column) for label, column, _ in self.SCORE_BUCKETS}
+        }
+
+class QuestionAnalyticsRollup(db.Model):
+    """Running per-question answer totals, kept current as answers are submitted"""
+    question_id = db.Column(db.Integer, db.ForeignKey('question.id'), primary_key=True)
+    total_attempts = db.Column(db.Integer, default=0, nullable=False)
+    correct_attempts = db.Column(db.Integer, default=0, nullable=False)
+    sum_time = db.Column(db.BigInteger, default=0, nullable=False)  # Only answers with a non-zero time
+    count_time = db.Column(db.Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return f'<QuestionAnalyticsRollup {self.question_id}>'
+
+    @staticmethod
+    def answer_deltas(deltas, previous, current):
+        """Accumulate the swap of one answer's contribution; previous/current are (is_correct, time_taken_seconds) or None"""
+        for values, sign in ((previous, -1), (current, 1)):
+            if values is None:
+                continue
+            is_correct, time_taken = values
+            add_deltas(deltas, {
+                'total_attempts': 1,
+                'correct_attempts': 1 if is_correct else 0,
+                'sum_time': time_taken or 0,
+                'count_time': 1 if time_taken else 0
+            }, sign)
+        return deltas
+
+    @classmethod
+    def increment(cls, question_id, deltas):
+        """Add deltas to a question's counters, building its row from the answers table if it has none"""
+        if not increment_row(cls.question_id, question_id, deltas):
+            db.session.flush()
+            cls.create_missing(question_id=question_id)
+
+    @classmethod
+    def record_answer(cls, question_id, previous, current):
+        """Swap one answer's contribution; previous/current are (is_correct, time_taken_seconds) or None"""
+        cls.increment(question_id, cls.answer_deltas({}, previous, current))
+
+    @classmethod
+    def create_missing(cls, quiz_id=None, question_id=None):
+        """Insert rows computed from the answers table for questions that have none"""
+        nonzero_time = func.nullif(UserAnswer.time_taken_seconds, 0)
+        query = select(
+            Question.id,
+            func.count(UserAnswer.id),
+            count_where(UserAnswer.is_correct == True),
+            func.coalesce(func.sum(nonzero_time), 0),
+            func.count(nonzero_time)
+        ).select_from(Question).outerjoin(
+            UserAnswer, UserAnswer.question_id == Question.id
+        ).where(~exists().where(cls.question_id == Question.id)).group_by(Question.id)
+        if quiz_id is not None:
+            query = query.where(Question.quiz_id == quiz_id)
+        if question_id is not None:
+            query = query.where(Question.id == question_id)
+        db.session.execute(insert(cls).from_select(
+            ['question_id', 'total_attempts', 'correct_attempts', 'sum_time', 'count_time'], query
+        ))
+
+    @staticmethod
+    def serialize(rollup):
+        """Build the stats dict from anything exposing the counter columns as attributes (instance or Row)"""
+        return {
+            'total_attempts': rollup.total_attempts,
+            'correct_attempts': rollup.correct_attempts,
+            'accuracy_rate': (rollup.correct_attempts / rollup.total_attempts * 100) if rollup.total_attempts else 0,
+            'average_time': rollup.sum_time / rollup.count_time if rollup.count_time else 0
+        }
+
+    def to_dict(self):
+        return QuestionAnalyticsRollup.serialize(self)
+
+class GlobalStats(db.Model):
+    """Singleton row of running counters, so the dashboard doesn't scan the answers table"""
+    SINGLETON_ID = 1
+
+    id = db.Column(db.Integer, primary_key=True)
+    answers_total = db.Column(db.BigInteger, default=0, nullable=False)  # Answers with a known is_correct
+    answers_correct = db.Column(db.BigInteger, default=0, nullable=False)
+
+    def __repr__(self):
+        return f'<GlobalStats {self.answers_correct}/{self.answers_total}>'
+
+    @staticmethod
+    def answer_deltas(was_correct, is_correct):
+        """(total, correct) change for one answer whose is_correct went from was_correct to is_correct (None if absent)"""
+        return (is_correct is not None) - (was_correct is not None), (is_correct is True) - (was_correct is True)
+
+    @classmethod
+    def record_answer(cls, was_correct, is_correct):
+        """Move the counters for one answer whose is_correct went from was_correct to is_correct (None if absent)"""
+        cls.increment(*cls.answer_deltas(was_correct, is_correct))
+
+    @classmethod
+    def increment(cls, total_delta, correct_delta):
+        """Add to the running answer counters"""
+        if not total_delta and not correct_delta:
+            return
+        db.session.execute(
+            update(cls).where(cls.id == cls.SINGLETON_ID).values(
+                answers_total=cls.answers_total + total_delta,
+                answers_correct=cls.answers_correct + correct_delta
+            )
+        )
+
+    @staticmethod
+    def average_score(answers_correct, answers_total):
+        """Percentage of correct answers, rounded like the dashboard shows it"""
+        if not answers_total:
+            return 0
+        return round(answers_correct * 100.0 / answers_total, 1)
+
 class AdminLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     admin_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -1,7 +1,12 @@
 import os
-from flask import Blueprint, request, jsonify, send_from_directory, current_app
-from src.models.user import db, Question
-from src.routes.user import token_required, admin_required
+import mimetypes
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from flask import Blueprint, request, jsonify, send_from_directory, current_app, abort, make_response, Response, stream_with_context
+from werkzeug.security import safe_join
+from sqlalchemy.orm import load_only, raiseload
+from src.models.user import db, Quiz, Question
+from src.routes.user import json_route, token_required, admin_required
 from src.services.image_service import ImageService
 
 image_bp = Blueprint('image', __name__)
@@ -9,259 +14,398 @@ image_bp = Blueprint('image', __name__)
 # Initialize image service
 image_service = ImageService()
 
+# Images directory never changes after startup
+IMAGES_DIR = image_service.images_dir
+
+# Generated images are content-addressed and can be cached forever
+IMAGE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Every options image needs all four answers
+REQUIRED_OPTION_KEYS = frozenset('abcd')
+
+# Image URLs only depend on the filename, so memoize them
+get_image_url = lru_cache(maxsize=2048)(image_service.get_image_url)
+
+# Upper bound on threads used to render a whole quiz
+MAX_IMAGE_WORKERS = min(8, os.cpu_count() or 1)
+
+# Single-question renders run here so the request returns without waiting on them
+render_executor = ThreadPoolExecutor(max_workers=MAX_IMAGE_WORKERS, thread_name_prefix='image-render')
+
+def apply_question_images(question, result):
+    """Point a question at freshly rendered images and delete the ones it no longer uses"""
+    image_service.delete_question_images(
+        question, keep=(result['question_image'], result['options_image'])
+    )
+    question.question_image_path = result['question_image']
+    question.options_image_path = result['options_image']
+    Quiz.bump_version(question.quiz_id)
+
+def render_question_images(app, question_id):
+    """Background job: render a question's images, then switch the question over to them"""
+    with app.app_context():
+        try:
+            question = db.session.get(Question, question_id)
+            if question is None:
+                return
+            result = image_service.generate_question_images(question)
+            if not result['success']:
+                app.logger.error(f"Error generating images for question {question_id}: {result.get('error')}")
+                return
+            apply_question_images(question, result)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"Error generating images for question {question_id}: {e}")
+
+def generate_images_for_question(question):
+    """Render both images for a question; safe to run in a worker thread"""
+    try:
+        return question.id, image_service.generate_question_images(question)
+    except Exception as e:
+        return question.id, {'success': False, 'error': str(e)}
+
 @image_bp.route('/images/<filename>', methods=['GET'])
 def serve_image(filename):
     """Serve generated images"""
     try:
-        images_dir = image_service.images_dir
-        return send_from_directory(images_dir, filename)
+        # Behind nginx, let it send the file from an internal location
+        accel_prefix = current_app.config.get('IMAGES_ACCEL_REDIRECT_PREFIX')
+        if accel_prefix:
+            if safe_join(IMAGES_DIR, filename) is None:
+                abort(404)
+            response = make_response('')
+            response.headers['X-Accel-Redirect'] = f"{accel_prefix.rstrip('/')}/{filename}"
+            response.headers['Content-Type'] = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        else:
+            # Honors USE_X_SENDFILE for Apache/lighttpd style offload; also sets ETag and answers 304s
+            response = send_from_directory(IMAGES_DIR, filename)
+        
+        # Filenames carry a content hash, so a given URL never changes
+        response.headers['Cache-Control'] = IMAGE_CACHE_CONTROL
+        return response
     except Exception as e:
         return jsonify({'success': False, 'error': {'message': 'Image not found'}}), 404
 
 @image_bp.route('/images/question', methods=['POST'])
+@json_route
 @token_required
 @admin_required
 def generate_question_image(current_user):
     """Generate image for a question"""
-    try:
-        data = request.get_json()
-        
-        if not data:
-            return jsonify({'success': False, 'error': {'message': 'No data provided'}}), 400
-        
-        question_text = data.get('question_text')
-        question_id = data.get('question_id', 'preview')
-        
-        if not question_text:
-            return jsonify({'success': False, 'error': {'message': 'Question text is required'}}), 400
-        
-        # Generate question image
-        filename = image_service.generate_question_image(question_text, question_id)
-        image_url = image_service.get_image_url(filename)
-        
-        return jsonify({
-            'success': True,
-            'data': {
-                'filename': filename,
-                'url': image_url
-            },
-            'message': 'Question image generated successfully'
-        }), 200
-        
-    except Exception as e:
-        return jsonify({'success': False, 'error': {'message': str(e)}}), 500
+    data = request.get_json()
+    
+    if not data:
+        return jsonify({'success': False, 'error': {'message': 'No data provided'}}), 400
+    
+    question_text = data.get('question_text')
+    question_id = data.get('question_id', 'preview')
+    
+    if not question_text:
+        return jsonify({'success': False, 'error': {'message': 'Question text is required'}}), 400
+    
+    # Generate question image
+    filename = image_service.generate_question_image(question_text, question_id)
+    image_url = get_image_url(filename)
+    
+    return jsonify({
+        'success': True,
+        'data': {
+            'filename': filename,
+            'url': image_url
+        },
+        'message': 'Question image generated successfully'
+    }), 200
 
 @image_bp.route('/images/options', methods=['POST'])
+@json_route
 @token_required
 @admin_required
 def generate_options_image(current_user):
     """Generate image for question options"""
-    try:
-        data = request.get_json()
-        
-        if not data:
-            return jsonify({'success': False, 'error': {'message': 'No data provided'}}), 400
-        
-        options = data.get('options')
-        question_id = data.get('question_id', 'preview')
-        
-        if not options or not isinstance(options, dict):
-            return jsonify({'success': False, 'error': {'message': 'Options are required'}}), 400
-        
-        # Validate options format
-        required_keys = ['a', 'b', 'c', 'd']
-        if not all(key in options for key in required_keys):
-            return jsonify({'success': False, 'error': {'message': 'Options must include a, b, c, d'}}), 400
-        
-        # Generate options image
-        filename = image_service.generate_options_image(options, question_id)
-        image_url = image_service.get_image_url(filename)
-        
-        return jsonify({
-            'success': True,
-            'data': {
-                'filename': filename,
-                'url': image_url
-            },
-            'message': 'Options image generated successfully'
-        }), 200
-        
-    except Exception as e:
-        return jsonify({'success': False, 'error': {'message': str(e)}}), 500
+    data = request.get_json()
+    
+    if not data:
+        return jsonify({'success': False, 'error': {'message': 'No data provided'}}), 400
+    
+    options = data.get('options')
+    question_id = data.get('question_id', 'preview')
+    
+    if not options or not isinstance(options, dict):
+        return jsonify({'success': False, 'error': {'message': 'Options are required'}}), 400
+    
+    # Validate options format
+    if not REQUIRED_OPTION_KEYS.issubset(options):
+        return jsonify({'success': False, 'error': {'message': 'Options must include a, b, c, d'}}), 400
+    
+    # Generate options image
+    filename = image_service.generate_options_image(options, question_id)
+    image_url = get_image_url(filename)
+    
+    return jsonify({
+        'success': True,
+        'data': {
+            'filename': filename,
+            'url': image_url
+        },
+        'message': 'Options image generated successfully'
+    }), 200
 
 @image_bp.route('/questions/<int:question_id>/generate-images', methods=['POST'])
+@json_route
 @token_required
 @admin_required
 def generate_question_images(current_user, question_id):
     """Generate both question and options images for a specific question"""
-    try:
-        question = Question.query.get_or_404(question_id)
-        
-        # Delete existing images if they exist
-        image_service.delete_question_images(question)
-        
-        # Generate new images
-        result = image_service.generate_question_images(question)
+    question = db.session.get(Question, question_id)
+    if question is None:
+        abort(404)
+    
+    # Filenames follow from the content, so they are known before anything is drawn
+    question_image = image_service.question_image_filename(question.question_text, question.id)
+    options_image = image_service.options_image_filename(question.get_options(), question.id)
+    if not (image_service.image_exists(question_image) and image_service.image_exists(options_image)):
+        # Render in the background; the question keeps its old images until the new ones are written
+        render_executor.submit(render_question_images, current_app._get_current_object(), question.id)
+        return jsonify({
+            'success': True,
+            'data': {
+                'question_image': {
+                    'filename': question_image,
+                    'url': get_image_url(question_image)
+                },
+                'options_image': {
+                    'filename': options_image,
+                    'url': get_image_url(options_image)
+                }
+            },
+            'message': 'Images are being generated'
+        }), 202
+    
+    # Already rendered: just switch the question over
+    result = image_service.generate_question_images(question)
+    
+    if result['success']:
+        apply_question_images(question, result)
+        db.session.commit()
         
-        if result['success']:
-            # Update question with new image paths
-            question.question_image_path = result['question_image']
-            question.options_image_path = result['options_image']
-            db.session.commit()
-            
-            return jsonify({
-                'success': True,
-                'data': {
-                    'question_image': {
-                        'filename': result['question_image'],
-                        'url': image_service.get_image_url(result['question_image'])
-                    },
-                    'options_image': {
-                        'filename': result['options_image'],
-                        'url': image_service.get_image_url(result['options_image'])
-                    }
+        return jsonify({
+            'success': True,
+            'data': {
+                'question_image': {
+                    'filename': result['question_image'],
+                    'url': get_image_url(result['question_image'])
                 },
-                'message': 'Images generated successfully'
-            }), 200
-        else:
-            return jsonify({
-                'success': False,
-                'error': {'message': result.get('error', 'Failed to generate images')}
-            }), 500
-            
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'success': False, 'error': {'message': str(e)}}), 500
+                'options_image': {
+                    'filename': result['options_image'],
+                    'url': get_image_url(result['options_image'])
+                }
+            },
+            'message': 'Images generated successfully'
+        }), 200
+    else:
+        return jsonify({
+            'success': False,
+            'error': {'message': result.get('error', 'Failed to generate images')}
+        }), 500
 
 @image_bp.route('/quizzes/<int:quiz_id>/generate-all-images', methods=['POST'])
 @token_required
 @admin_required
 def generate_all_quiz_images(current_user, quiz_id):
-    """Generate images for all questions in a quiz"""
+    """Generate images for all questions in a quiz; NDJSON lines per question with ?stream=1"""
     try:
-        questions = Question.query.filter_by(quiz_id=quiz_id).all()
+        # Load just what rendering needs, and forbid lazy loads from the worker threads
+        questions = db.session.query(Question).options(
+            load_only(
+                Question.id, Question.question_text,
+                Question.option_a, Question.option_b, Question.option_c, Question.option_d,
+                Question.question_image_path, Question.options_image_path
+            ),
+            raiseload('*')
+        ).filter_by(quiz_id=quiz_id).all()
         
         if not questions:
             return jsonify({'success': False, 'error': {'message': 'No questions found for this quiz'}}), 404
         
-        results = []
-        errors = []
-        
-        for question in questions:
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': {'message': str(e)}}), 500
+    
+    # Streaming is opt-in, so clients of the single JSON response keep working
+    stream = (request.args.get('stream', '').lower() in ('1', 'true', 'yes')
+              or request.accept_mimetypes.best == 'application/x-ndjson')
+    if stream:
+        def generate():
+            lines = render_quiz_images(quiz_id, questions)
             try:
-                # Delete existing images
-                image_service.delete_question_images(question)
-                
-                # Generate new images
-                result = image_service.generate_question_images(question)
-                
+                for line in lines:
+                    yield current_app.json.dumps(line) + '\n'
+            finally:
+                # A client that went away still gets its renders saved
+                lines.close()
+                db.session.close()
+        
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    
+    results = []
+    errors = []
+    for line in render_quiz_images(quiz_id, questions):
+        if 'question_id' not in line:
+            summary = line
+        elif line['success']:
+            results.append({key: line[key] for key in ('question_id', 'question_image', 'options_image')})
+        else:
+            errors.append({'question_id': line['question_id'], 'error': line['error']})
+    
+    if not summary['success']:
+        return jsonify({'success': False, 'error': summary['error']}), 500
+    
+    return jsonify({
+        'success': True,
+        'data': {
+            'generated': len(results),
+            'errors': len(errors),
+            'results': results,
+            'error_details': errors
+        },
+        'message': summary['message']
+    }), 200
+
+def render_quiz_images(quiz_id, questions):
+    """Render a quiz's images, yielding a result per question and then a summary of the save"""
+    updates = []
+    stale_images = []
+    error_count = 0
+    render_error = None
+    
+    try:
+        # Render images in parallel; Pillow releases the GIL while drawing and encoding
+        max_workers = min(MAX_IMAGE_WORKERS, len(questions))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Results arrive in question order as soon as each one is rendered
+            rendered = executor.map(generate_images_for_question, questions)
+            for question, (question_id, result) in zip(questions, rendered):
                 if result['success']:
-                    # Update question with new image paths
-                    question.question_image_path = result['question_image']
-                    question.options_image_path = result['options_image']
-                    
-                    results.append({
-                        'question_id': question.id,
+                    # Previous images are deleted only once the new paths are committed
+                    stale_images.append((
+                        question.question_image_path, question.options_image_path,
+                        (result['question_image'], result['options_image'])
+                    ))
+                    # Collect new image paths for a single bulk update
+                    updates.append({
+                        'id': question_id,
+                        'question_image_path': result['question_image'],
+                        'options_image_path': result['options_image']
+                    })
+                    yield {
+                        'success': True,
+                        'question_id': question_id,
                         'question_image': result['question_image'],
                         'options_image': result['options_image']
-                    })
+                    }
                 else:
-                    errors.append({
-                        'question_id': question.id,
+                    error_count += 1
+                    yield {
+                        'success': False,
+                        'question_id': question_id,
                         'error': result.get('error', 'Unknown error')
-                    })
-                    
-            except Exception as e:
-                errors.append({
-                    'question_id': question.id,
-                    'error': str(e)
-                })
-        
-        # Commit all successful updates
-        if results:
-            db.session.commit()
-        
-        return jsonify({
+                    }
+    except Exception as e:
+        render_error = str(e)
+    finally:
+        # Persist whatever was rendered, even if a streaming client went away mid-way
+        save_error = None
+        try:
+            if updates:
+                db.session.bulk_update_mappings(Question, updates)
+                Quiz.bump_version(quiz_id)
+                db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Error saving image paths for quiz {quiz_id}: {e}")
+            save_error = str(e)
+        else:
+            for question_image_path, options_image_path, keep in stale_images:
+                image_service.delete_images(question_image_path, options_image_path, keep)
+    
+    if save_error is not None:
+        # Questions still point at their previous images, which were kept
+        yield {'success': False, 'error': {'message': f'Failed to save image paths: {save_error}'}}
+    elif render_error is not None:
+        yield {'success': False, 'error': {'message': render_error}}
+    else:
+        yield {
             'success': True,
             'data': {
-                'generated': len(results),
-                'errors': len(errors),
-                'results': results,
-                'error_details': errors
+                'generated': len(updates),
+                'errors': error_count
             },
-            'message': f'Generated images for {len(results)} questions'
-        }), 200
-        
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'success': False, 'error': {'message': str(e)}}), 500
+            'message': f'Generated images for {len(updates)} questions'
+        }
 
 @image_bp.route('/questions/<int:question_id>/images', methods=['GET'])
+@json_route
 @token_required
 def get_question_images(current_user, question_id):
     """Get image URLs for a question"""
-    try:
-        question = Question.query.get_or_404(question_id)
-        
-        # Check if user has access to this question
-        # For now, allow access if user is taking the quiz or is admin
-        if current_user.role != 'admin':
-            # Additional access control can be added here
-            pass
-        
-        return jsonify({
-            'success': True,
-            'data': {
-                'question_image': image_service.get_image_url(question.question_image_path),
-                'options_image': image_service.get_image_url(question.options_image_path)
-            },
-            'message': 'Question images retrieved'
-        }), 200
-        
-    except Exception as e:
-        return jsonify({'success': False, 'error': {'message': str(e)}}), 500
+    question = db.session.get(Question, question_id)
+    if question is None:
+        abort(404)
+    
+    # Check if user has access to this question
+    # For now, allow access if user is taking the quiz or is admin
+    if current_user.role != 'admin':
+        # Additional access control can be added here
+        pass
+    
+    return jsonify({
+        'success': True,
+        'data': {
+            'question_image': get_image_url(question.question_image_path),
+            'options_image': get_image_url(question.options_image_path)
+        },
+        'message': 'Question images retrieved'
+    }), 200
 
 @image_bp.route('/images/preview', methods=['POST'])
+@json_route
 @token_required
 @admin_required
 def preview_images(current_user):
     """Generate preview images for question and options"""
-    try:
-        data = request.get_json()
-        
-        if not data:
-            return jsonify({'success': False, 'error': {'message': 'No data provided'}}), 400
-        
-        question_text = data.get('question_text')
-        options = data.get('options')
-        
-        if not question_text or not options:
-            return jsonify({'success': False, 'error': {'message': 'Question text and options are required'}}), 400
-        
-        results = {}
-        
-        # Generate question image preview
-        if question_text:
-            question_filename = image_service.generate_question_image(question_text, 'preview')
-            results['question_image'] = {
-                'filename': question_filename,
-                'url': image_service.get_image_url(question_filename)
-            }
-        
-        # Generate options image preview
-        if options and isinstance(options, dict):
-            options_filename = image_service.generate_options_image(options, 'preview')
-            results['options_image'] = {
-                'filename': options_filename,
-                'url': image_service.get_image_url(options_filename)
-            }
-        
-        return jsonify({
-            'success': True,
-            'data': results,
-            'message': 'Preview images generated successfully'
-        }), 200
-        
-    except Exception as e:
-        return jsonify({'success': False, 'error': {'message': str(e)}}), 500
+    data = request.get_json()
+    
+    if not data:
+        return jsonify({'success': False, 'error': {'message': 'No data provided'}}), 400
+    
+    question_text = data.get('question_text')
+    options = data.get('options')
+    
+    if not question_text or not options:
+        return jsonify({'success': False, 'error': {'message': 'Question text and options are required'}}), 400
+    
+    results = {}
+    
+    # Generate question image preview
+    if question_text:
+        question_filename = image_service.generate_question_image(question_text, 'preview')
+        results['question_image'] = {
+            'filename': question_filename,
+            'url': get_image_url(question_filename)
+        }
+    
+    # Generate options image preview
+    if options and isinstance(options, dict):
+        options_filename = image_service.generate_options_image(options, 'preview')
+        results['options_image'] = {
+            'filename': options_filename,
+            'url': get_image_url(options_filename)
+        }
+    
+    return jsonify({
+        'success': True,
+        'data': results,
+        'message': 'Preview images generated successfully'
+    }), 200
 
@@ -1,526 +1,685 @@
-from flask import Blueprint, request, jsonify, current_app
-from src.models.user import db, Quiz, Question, User, UserSession, UserAnswer
-from src.routes.user import token_required, admin_required
+from flask import Blueprint, request, jsonify, current_app, abort
+from src.models.user import db, Quiz, Question, User, UserSession, GlobalStats, QuizAnalyticsRollup, QuestionAnalyticsRollup
+from src.routes.user import json_route, token_required, admin_required, paginate_rows, MAX_PER_PAGE
+from src.services.cache_service import cache_service, ADMIN_STATS_CACHE_KEY, ADMIN_STATS_TTL
 from datetime import datetime, timedelta
-from sqlalchemy import func
+from sqlalchemy import func, select, distinct, exists, or_, and_, update, insert, delete
+from sqlalchemy.orm import selectinload
+from werkzeug.exceptions import HTTPException
+import csv
+import io
 
 quiz_bp = Blueprint('quiz', __name__)
 
+def parse_datetime(value):
+    """Parse an optional ISO 8601 timestamp from a request payload"""
+    return datetime.fromisoformat(value) if value else None
+
+# Column-only selects for list endpoints; rows go straight to serialize() without ORM instances
+QUIZ_COLUMNS = tuple(Quiz.__table__.columns)
+QUESTION_COLUMNS = tuple(Question.__table__.columns)
+
+# Payload keys the admin edit endpoints may write
+QUIZ_UPDATE_FIELDS = (
+    'title', 'description', 'duration_minutes', 'per_question_time_seconds',
+    'randomize_questions', 'randomize_options', 'is_active', 'start_time', 'end_time'
+)
+QUESTION_UPDATE_FIELDS = (
+    'question_text', 'option_a', 'option_b', 'option_c', 'option_d',
+    'correct_answer', 'question_order', 'time_bonus_factor'
+)
+QUESTION_TEXT_FIELDS = ('question_text', 'option_a', 'option_b', 'option_c', 'option_d')
+
+# Sub-requests allowed in one /admin/batch call
+MAX_BATCH_REQUESTS = 10
+
+# Rows per executemany INSERT when importing questions from CSV
+BULK_INSERT_BATCH_SIZE = 500
+
+def abort_unless_quiz_exists(quiz_id):
+    """404 unless the quiz row exists, checked with EXISTS rather than loading it"""
+    if not db.session.scalar(select(exists().where(Quiz.id == quiz_id))):
+        abort(404)
+
 @quiz_bp.route('/admin/stats', methods=['GET'])
+@json_route
 @token_required
 @admin_required
 def get_admin_stats(current_user):
     """Get admin dashboard statistics"""
-    try:
-        # Count total users
-        total_users = User.query.count()
-        
-        # Count total quizzes
-        total_quizzes = Quiz.query.count()
-        
-        # Count total sessions
-        total_sessions = UserSession.query.count()
-        
-        # Calculate average score
-        avg_score_query = db.session.query(func.avg(UserAnswer.is_correct * 100)).scalar()
-        average_score = round(avg_score_query, 1) if avg_score_query else 0
-        
-        # Count active users (users who have taken a quiz in the last 24 hours)
-        yesterday = datetime.utcnow() - timedelta(days=1)
-        active_users = UserSession.query.filter(
+    # Dashboard auto-refreshes, so serve recent numbers from the cache
+    cached_stats = cache_service.get_json(ADMIN_STATS_CACHE_KEY)
+    if cached_stats is not None:
+        return jsonify({'success': True, 'data': cached_stats})
+    
+    yesterday = datetime.utcnow() - timedelta(days=1)
+    
+    # All counters as scalar subqueries of one SELECT
+    stats = db.session.execute(select(
+        select(func.count(User.id)).scalar_subquery(),
+        select(func.count(Quiz.id)).scalar_subquery(),
+        select(func.count(UserSession.id)).scalar_subquery(),
+        # Answer counters are kept up to date on submit, so this is a single-row read
+        select(GlobalStats.answers_correct).where(GlobalStats.id == GlobalStats.SINGLETON_ID).scalar_subquery(),
+        select(GlobalStats.answers_total).where(GlobalStats.id == GlobalStats.SINGLETON_ID).scalar_subquery(),
+        # Active users: users who have taken a quiz in the last 24 hours
+        select(func.count(distinct(UserSession.user_id))).where(
             UserSession.start_time >= yesterday
-        ).distinct(UserSession.user_id).count()
-        
-        return jsonify({
-            'success': True,
-            'data': {
-                'totalUsers': total_users,
-                'totalQuizzes': total_quizzes,
-                'totalSessions': total_sessions,
-                'averageScore': average_score,
-                'activeUsers': active_users
-            }
-        })
-        
-    except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': {'message': f'Failed to get stats: {str(e)}'}
-        }), 500
+        ).scalar_subquery()
+    )).one()
+    
+    total_users, total_quizzes, total_sessions, answers_correct, answers_total, active_users = stats
+    average_score = GlobalStats.average_score(answers_correct, answers_total)
+    
+    stats_data = {
+        'totalUsers': total_users,
+        'totalQuizzes': total_quizzes,
+        'totalSessions': total_sessions,
+        'averageScore': average_score,
+        'activeUsers': active_users
+    }
+    cache_service.set_json(ADMIN_STATS_CACHE_KEY, stats_data, ADMIN_STATS_TTL)
+    
+    return jsonify({
+        'success': True,
+        'data': stats_data
+    })
+
+def sub_request_environ(environ, url):
+    """WSGI environ for a GET of url ("/path?query"), carrying over the batch request's headers"""
+    path, _, query_string = url.partition('?')
+    sub_environ = {key: value for key, value in environ.items() if key not in ('CONTENT_TYPE', 'RAW_URI', 'REQUEST_URI')}
+    sub_environ.update({
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': path,
+        'QUERY_STRING': query_string,
+        'CONTENT_LENGTH': '0',
+        'wsgi.input': io.BytesIO()
+    })
+    return sub_environ
+
+@quiz_bp.route('/admin/batch', methods=['POST'])
+@json_route
+@token_required
+@admin_required
+def batch_admin_requests(current_user):
+    """Run several admin GET requests in one round-trip (admin only)"""
+    data = request.get_json()
+    paths = data.get('paths') if isinstance(data, dict) else data
+    
+    if not paths or not isinstance(paths, list):
+        return jsonify({'success': False, 'error': {'message': 'A list of paths is required'}}), 400
+    
+    if len(paths) > MAX_BATCH_REQUESTS:
+        return jsonify({'success': False, 'error': {'message': f'At most {MAX_BATCH_REQUESTS} paths per batch'}}), 400
+    
+    # Paths are relative to the API prefix, e.g. "/admin/stats"
+    api_prefix = request.path[:-len('/admin/batch')]
+    app = current_app._get_current_object()
+    
+    responses = {}
+    for path in paths:
+        if not isinstance(path, str) or not path.startswith('/admin/') or path.startswith('/admin/batch'):
+            responses[path] = {'status': 400, 'body': {'success': False, 'error': {'message': 'Only admin GET paths can be batched'}}}
+            continue
+        
+        # A fresh app context per path gives each sub-request its own db.session (and g),
+        # so one path's failure or rollback can't leak into the others or into this request
+        environ = sub_request_environ(request.environ, api_prefix + path)
+        
+        # Only API routes (blueprint endpoints) run; anything else would fall through to the SPA
+        try:
+            endpoint, _ = app.url_map.bind_to_environ(environ).match(method='GET')
+        except HTTPException:
+            endpoint = None
+        if endpoint is None or '.' not in endpoint:
+            responses[path] = {'status': 404, 'body': {'success': False, 'error': {'message': 'Resource not found'}}}
+            continue
+        
+        with app.app_context(), app.request_context(environ):
+            try:
+                response = app.full_dispatch_request()
+                responses[path] = {'status': response.status_code, 'body': response.get_json(silent=True)}
+            except Exception as e:
+                app.logger.exception(f"Batched request {path} failed")
+                responses[path] = {'status': 500, 'body': {'success': False, 'error': {'message': str(e)}}}
+    
+    return jsonify({
+        'success': True,
+        'data': responses,
+        'message': 'Batch completed'
+    }), 200
 
 # Public Quiz Endpoints (for users)
 
 @quiz_bp.route('/quizzes', methods=['GET'])
+@json_route
 @token_required
 def get_available_quizzes(current_user):
     """Get all available quizzes for users"""
-    try:
-        quizzes = Quiz.query.filter_by(is_active=True).all()
-        available_quizzes = [quiz.to_dict() for quiz in quizzes if quiz.is_available()]
-        
-        return jsonify({
-            'success': True,
-            'data': available_quizzes,
-            'message': 'Available quizzes retrieved'
-        }), 200
-        
-    except Exception as e:
-        return jsonify({'success': False, 'error': {'message': str(e)}}), 500
+    page = request.args.get('page', 1, type=int)
+    per_page = min(request.args.get('per_page', 20, type=int), MAX_PER_PAGE)
+    now = datetime.utcnow()
+    
+    # Availability window is checked in SQL; rows are serialized without building ORM instances
+    rows, total, pages = paginate_rows(
+        select(*QUIZ_COLUMNS).where(Quiz.is_available(now)).order_by(Quiz.id),
+        page, per_page
+    )
+    available_quizzes = [Quiz.serialize(row) for row in rows]
+    
+    return jsonify({
+        'success': True,
+        'data': available_quizzes,
+        'pagination': {
+            'page': page,
+            'per_page': per_page,
+            'total': total,
+            'pages': pages
+        },
+        'message': 'Available quizzes retrieved'
+    }), 200
 
 @quiz_bp.route('/quizzes/<int:quiz_id>', methods=['GET'])
+@json_route
 @token_required
 def get_quiz_info(current_user, quiz_id):
     """Get quiz information (without questions)"""
-    try:
-        quiz = Quiz.query.get_or_404(quiz_id)
-        
-        if not quiz.is_available():
-            return jsonify({'success': False, 'error': {'message': 'Quiz is not available'}}), 403
-        
-        return jsonify({
-            'success': True,
-            'data': quiz.to_dict(),
-            'message': 'Quiz information retrieved'
-        }), 200
-        
-    except Exception as e:
-        return jsonify({'success': False, 'error': {'message': str(e)}}), 500
+    # Plain column row, no ORM instance is built for this polled endpoint
+    quiz = db.session.execute(
+        select(*QUIZ_COLUMNS).where(Quiz.id == quiz_id)
+    ).first()
+    if quiz is None:
+        abort(404)
+    
+    if not Quiz.check_available(quiz.is_active, quiz.start_time, quiz.end_time):
+        return jsonify({'success': False, 'error': {'message': 'Quiz is not available'}}), 403
+    
+    return jsonify({
+        'success': True,
+        'data': Quiz.serialize(quiz),
+        'message': 'Quiz information retrieved'
+    }), 200
 
 @quiz_bp.route('/quizzes/<int:quiz_id>/start', methods=['POST'])
+@json_route
 @token_required
 def start_quiz(current_user, quiz_id):
     """Start a new quiz session"""
-    try:
-        quiz = Quiz.query.get_or_404(quiz_id)
-        
-        if not quiz.is_available():
-            return jsonify({'success': False, 'error': {'message': 'Quiz is not available'}}), 403
-        
-        # Check if user already has an active session for this quiz
-        existing_session = UserSession.query.filter_by(
-            user_id=current_user.id,
-            quiz_id=quiz_id,
-            is_completed=False
-        ).first()
-        
-        if existing_session and existing_session.is_active():
-            return jsonify({
-                'success': True,
-                'data': existing_session.to_dict(),
-                'message': 'Existing active session found'
-            }), 200
-        
-        # Create new session
-        session = UserSession(
-            user_id=current_user.id,
-            quiz_id=quiz_id,
-            ip_address=request.remote_addr,
-            user_agent=request.headers.get('User-Agent', '')
-        )
-        
-        # Set end time based on quiz duration
-        session.end_time = datetime.utcnow().replace(
-            second=0, microsecond=0
-        ) + timedelta(minutes=quiz.duration_minutes)
-        
-        db.session.add(session)
-        db.session.commit()
-        
+    quiz = Quiz.query.get_or_404(quiz_id)
+    now = datetime.utcnow()
+    
+    if not quiz.is_available(now):
+        return jsonify({'success': False, 'error': {'message': 'Quiz is not available'}}), 403
+    
+    # Check if user already has an active session for this quiz
+    existing_session_id = db.session.query(UserSession.id).filter_by(
+        user_id=current_user.id,
+        quiz_id=quiz_id,
+        is_completed=False
+    ).limit(1).scalar()
+    
+    # Only hydrate the full row when there is one
+    existing_session = db.session.get(UserSession, existing_session_id) if existing_session_id else None
+    
+    if existing_session and existing_session.is_active():
         return jsonify({
             'success': True,
-            'data': session.to_dict(),
-            'message': 'Quiz session started'
-        }), 201
-        
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'success': False, 'error': {'message': str(e)}}), 500
+            'data': existing_session.to_dict(),
+            'message': 'Existing active session found'
+        }), 200
+    
+    # Create new session
+    session = UserSession(
+        user_id=current_user.id,
+        quiz_id=quiz_id,
+        ip_address=request.remote_addr,
+        user_agent=request.headers.get('User-Agent', '')
+    )
+    
+    # Set end time based on quiz duration
+    session.end_time = now.replace(
+        second=0, microsecond=0
+    ) + timedelta(minutes=quiz.duration_minutes)
+    
+    db.session.add(session)
+    QuizAnalyticsRollup.increment(quiz_id, total_attempts=1)
+    db.session.commit()
+    cache_service.delete(ADMIN_STATS_CACHE_KEY)
+    
+    return jsonify({
+        'success': True,
+        'data': session.to_dict(),
+        'message': 'Quiz session started'
+    }), 201
 
 # Admin Quiz Management Endpoints
 
 @quiz_bp.route('/admin/quizzes', methods=['GET'])
+@json_route
 @token_required
 @admin_required
 def get_all_quizzes(current_user):
     """Get all quizzes (admin only)"""
-    try:
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
-        
-        quizzes = Quiz.query.paginate(
-            page=page, per_page=per_page, error_out=False
-        )
-        
-        return jsonify({
-            'success': True,
-            'data': {
-                'quizzes': [quiz.to_dict() for quiz in quizzes.items],
-                'pagination': {
-                    'page': page,
-                    'per_page': per_page,
-                    'total': quizzes.total,
-                    'pages': quizzes.pages
-                }
-            },
-            'message': 'Quizzes retrieved successfully'
-        }), 200
-        
-    except Exception as e:
-        return jsonify({'success': False, 'error': {'message': str(e)}}), 500
+    page = request.args.get('page', 1, type=int)
+    per_page = min(request.args.get('per_page', 20, type=int), MAX_PER_PAGE)
+    after_id = request.args.get('after_id', type=int)
+    with_total = request.args.get('with_total', '').lower() in ('1', 'true', 'yes')
+    
+    if after_id is None:
+        # Page-numbered listing, the original response shape; next_cursor lets clients switch to after_id
+        rows, total, pages = paginate_rows(select(*QUIZ_COLUMNS).order_by(Quiz.id), page, per_page)
+        pagination = {
+            'page': page,
+            'per_page': per_page,
+            'total': total,
+            'pages': pages,
+            'next_cursor': rows[-1].id if rows and page < pages else None
+        }
+    else:
+        # Keyset pagination in the same id order: after_id is the id of the last quiz already seen
+        rows = db.session.execute(
+            select(*QUIZ_COLUMNS).where(Quiz.id > after_id).order_by(Quiz.id).limit(per_page + 1)
+        ).all()
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
+        
+        pagination = {
+            'per_page': per_page,
+            'next_cursor': rows[-1].id if has_more else None
+        }
+        # COUNT(*) is a full scan, so only pay for it when asked
+        if with_total:
+            pagination['total'] = db.session.scalar(select(func.count(Quiz.id)))
+    
+    return jsonify({
+        'success': True,
+        'data': {
+            'quizzes': [Quiz.serialize(row) for row in rows],
+            'pagination': pagination
+        },
+        'message': 'Quizzes retrieved successfully'
+    }), 200
 
 @quiz_bp.route('/admin/quizzes', methods=['POST'])
+@json_route
 @token_required
 @admin_required
 def create_quiz(current_user):
     """Create a new quiz (admin only)"""
-    try:
-        data = request.get_json()
-        
-        if not data:
-            return jsonify({'success': False, 'error': {'message': 'No data provided'}}), 400
-        
-        title = data.get('title', '').strip()
-        description = data.get('description', '').strip()
-        duration_minutes = data.get('duration_minutes')
-        
-        if not title or not duration_minutes:
-            return jsonify({'success': False, 'error': {'message': 'Title and duration are required'}}), 400
-        
-        quiz = Quiz(
-            title=title,
-            description=description,
-            duration_minutes=duration_minutes,
-            per_question_time_seconds=data.get('per_question_time_seconds'),
-            randomize_questions=data.get('randomize_questions', False),
-            randomize_options=data.get('randomize_options', False),
-            created_by=current_user.id,
-            start_time=datetime.fromisoformat(data['start_time']) if data.get('start_time') else None,
-            end_time=datetime.fromisoformat(data['end_time']) if data.get('end_time') else None
-        )
-        
-        db.session.add(quiz)
-        db.session.commit()
-        
-        return jsonify({
-            'success': True,
-            'data': quiz.to_dict(),
-            'message': 'Quiz created successfully'
-        }), 201
-        
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'success': False, 'error': {'message': str(e)}}), 500
+    data = request.get_json()
+    
+    if not data:
+        return jsonify({'success': False, 'error': {'message': 'No data provided'}}), 400
+    
+    title = data.get('title', '').strip()
+    description = data.get('description', '').strip()
+    duration_minutes = data.get('duration_minutes')
+    
+    if not title or not duration_minutes:
+        return jsonify({'success': False, 'error': {'message': 'Title and duration are required'}}), 400
+    
+    quiz = Quiz(
+        title=title,
+        description=description,
+        duration_minutes=duration_minutes,
+        per_question_time_seconds=data.get('per_question_time_seconds'),
+        randomize_questions=data.get('randomize_questions', False),
+        randomize_options=data.get('randomize_options', False),
+        created_by=current_user.id,
+        start_time=parse_datetime(data.get('start_time')),
+        end_time=parse_datetime(data.get('end_time'))
+    )
+    
+    db.session.add(quiz)
+    db.session.flush()
+    db.session.add(QuizAnalyticsRollup(quiz_id=quiz.id))
+    db.session.commit()
+    cache_service.delete(ADMIN_STATS_CACHE_KEY)
+    
+    return jsonify({
+        'success': True,
+        'data': quiz.to_dict(),
+        'message': 'Quiz created successfully'
+    }), 201
 
 @quiz_bp.route('/admin/quizzes/<int:quiz_id>', methods=['GET'])
+@json_route
 @token_required
 @admin_required
 def get_quiz_details(current_user, quiz_id):
     """Get quiz details with questions (admin only)"""
-    try:
-        quiz = Quiz.query.get_or_404(quiz_id)
-        
-        return jsonify({
-            'success': True,
-            'data': quiz.to_dict(include_questions=True),
-            'message': 'Quiz details retrieved'
-        }), 200
-        
-    except Exception as e:
-        return jsonify({'success': False, 'error': {'message': str(e)}}), 500
+    # Questions arrive in one IN query rather than lazily per access
+    quiz = db.session.execute(
+        select(Quiz).options(selectinload(Quiz.questions)).where(Quiz.id == quiz_id)
+    ).scalar_one_or_none() or abort(404)
+    
+    return jsonify({
+        'success': True,
+        'data': quiz.to_dict(include_questions=True),
+        'message': 'Quiz details retrieved'
+    }), 200
 
 @quiz_bp.route('/admin/quizzes/<int:quiz_id>', methods=['PUT'])
+@json_route
 @token_required
 @admin_required
 def update_quiz(current_user, quiz_id):
     """Update quiz (admin only)"""
-    try:
-        quiz = Quiz.query.get_or_404(quiz_id)
-        data = request.get_json()
-        
-        if not data:
-            return jsonify({'success': False, 'error': {'message': 'No data provided'}}), 400
-        
-        # Update allowed fields
-        if 'title' in data:
-            quiz.title = data['title'].strip()
-        if 'description' in data:
-            quiz.description = data['description'].strip()
-        if 'duration_minutes' in data:
-            quiz.duration_minutes = data['duration_minutes']
-        if 'per_question_time_seconds' in data:
-            quiz.per_question_time_seconds = data['per_question_time_seconds']
-        if 'randomize_questions' in data:
-            quiz.randomize_questions = data['randomize_questions']
-        if 'randomize_options' in data:
-            quiz.randomize_options = data['randomize_options']
-        if 'is_active' in data:
-            quiz.is_active = data['is_active']
-        if 'start_time' in data:
-            quiz.start_time = datetime.fromisoformat(data['start_time']) if data['start_time'] else None
-        if 'end_time' in data:
-            quiz.end_time = datetime.fromisoformat(data['end_time']) if data['end_time'] else None
-        
-        db.session.commit()
-        
-        return jsonify({
-            'success': True,
-            'data': quiz.to_dict(),
-            'message': 'Quiz updated successfully'
-        }), 200
-        
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'success': False, 'error': {'message': str(e)}}), 500
+    data = request.get_json()
+    
+    if not data:
+        return jsonify({'success': False, 'error': {'message': 'No data provided'}}), 400
+    
+    # Update allowed fields
+    updates = {field: data[field] for field in QUIZ_UPDATE_FIELDS if field in data}
+    if 'description' in updates and updates['description'] is None:
+        updates['description'] = ''
+    for field in ('title', 'description'):
+        if field in updates:
+            if not isinstance(updates[field], str):
+                return jsonify({'success': False, 'error': {'message': f'{field} must be a string'}}), 400
+            updates[field] = updates[field].strip()
+    if updates.get('title') == '':
+        return jsonify({'success': False, 'error': {'message': 'Title is required'}}), 400
+    for field in ('start_time', 'end_time'):
+        if field in updates:
+            updates[field] = parse_datetime(updates[field])
+    
+    # One UPDATE ... RETURNING instead of loading the row first
+    if updates:
+        statement = update(Quiz).where(Quiz.id == quiz_id).values(**updates).returning(*QUIZ_COLUMNS)
+    else:
+        statement = select(*QUIZ_COLUMNS).where(Quiz.id == quiz_id)
+    quiz = db.session.execute(statement).first()
+    if quiz is None:
+        abort(404)
+    
+    db.session.commit()
+    
+    return jsonify({
+        'success': True,
+        'data': Quiz.serialize(quiz),
+        'message': 'Quiz updated successfully'
+    }), 200
 
 @quiz_bp.route('/admin/quizzes/<int:quiz_id>', methods=['DELETE'])
+@json_route
 @token_required
 @admin_required
 def delete_quiz(current_user, quiz_id):
     """Delete quiz (admin only)"""
-    try:
-        quiz = Quiz.query.get_or_404(quiz_id)
-        
-        # Soft delete by deactivating
-        quiz.is_active = False
-        db.session.commit()
-        
-        return jsonify({
-            'success': True,
-            'message': 'Quiz deactivated successfully'
-        }), 200
-        
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'success': False, 'error': {'message': str(e)}}), 500
+    quiz = Quiz.query.get_or_404(quiz_id)
+    
+    # Soft delete by deactivating
+    quiz.is_active = False
+    db.session.commit()
+    
+    return jsonify({
+        'success': True,
+        'message': 'Quiz deactivated successfully'
+    }), 200
 
 # Question Management Endpoints
 
 @quiz_bp.route('/admin/questions/<int:quiz_id>', methods=['GET'])
+@json_route
 @token_required
 @admin_required
 def get_quiz_questions(current_user, quiz_id):
     """Get all questions for a quiz (admin only)"""
-    try:
-        quiz = Quiz.query.get_or_404(quiz_id)
-        questions = Question.query.filter_by(quiz_id=quiz_id).order_by(Question.question_order).all()
-        
-        return jsonify({
-            'success': True,
-            'data': [question.to_dict(include_correct_answer=True) for question in questions],
-            'message': 'Questions retrieved successfully'
-        }), 200
-        
-    except Exception as e:
-        return jsonify({'success': False, 'error': {'message': str(e)}}), 500
+    abort_unless_quiz_exists(quiz_id)
+    
+    # question_order is nullable, so NULL sorts and pages as 0 (the column default)
+    position = func.coalesce(Question.question_order, 0)
+    query = select(*QUESTION_COLUMNS, position.label('position')).where(Question.quiz_id == quiz_id)
+    cursor = request.args.get('cursor')
+    limit = request.args.get('limit', type=int)
+    
+    if cursor is None and limit is None:
+        # Page-numbered listing (page/per_page); next_cursor lets clients switch to cursor paging
+        page = request.args.get('page', 1, type=int)
+        per_page = min(request.args.get('per_page', 20, type=int), MAX_PER_PAGE)
+        questions, total, pages = paginate_rows(query.order_by(position, Question.id), page, per_page)
+        pagination = {
+            'page': page,
+            'per_page': per_page,
+            'total': total,
+            'pages': pages,
+            'next_cursor': f"{questions[-1].position}:{questions[-1].id}" if questions and page < pages else None
+        }
+    else:
+        # Keyset pagination: cursor is "<question_order>:<id>" of the last question already seen
+        limit = min(limit or MAX_PER_PAGE, MAX_PER_PAGE)
+        if cursor:
+            try:
+                after_order, after_id = (int(part) for part in cursor.split(':'))
+            except ValueError:
+                return jsonify({'success': False, 'error': {'message': 'Invalid cursor'}}), 400
+            query = query.where(or_(
+                position > after_order,
+                and_(position == after_order, Question.id > after_id)
+            ))
+        
+        questions = db.session.execute(
+            query.order_by(position, Question.id).limit(limit + 1)
+        ).all()
+        has_more = len(questions) > limit
+        questions = questions[:limit]
+        pagination = {
+            'limit': limit,
+            'next_cursor': f"{questions[-1].position}:{questions[-1].id}" if has_more else None
+        }
+    
+    return jsonify({
+        'success': True,
+        'data': [Question.serialize(question, include_correct_answer=True) for question in questions],
+        'pagination': pagination,
+        'message': 'Questions retrieved successfully'
+    }), 200
 
 @quiz_bp.route('/admin/questions', methods=['POST'])
+@json_route
 @token_required
 @admin_required
 def create_question(current_user):
     """Create a new question (admin only)"""
-    try:
-        data = request.get_json()
-        
-        if not data:
-            return jsonify({'success': False, 'error': {'message': 'No data provided'}}), 400
-        
-        required_fields = ['quiz_id', 'question_text', 'option_a', 'option_b', 'option_c', 'option_d', 'correct_answer']
-        for field in required_fields:
-            if not data.get(field):
-                return jsonify({'success': False, 'error': {'message': f'{field} is required'}}), 400
-        
-        # Validate correct answer
-        if data['correct_answer'] not in ['a', 'b', 'c', 'd']:
-            return jsonify({'success': False, 'error': {'message': 'Correct answer must be a, b, c, or d'}}), 400
-        
-        # Check if quiz exists
-        quiz = Quiz.query.get_or_404(data['quiz_id'])
-        
-        # Get next question order
-        max_order = db.session.query(db.func.max(Question.question_order)).filter_by(quiz_id=data['quiz_id']).scalar() or 0
-        
-        question = Question(
-            quiz_id=data['quiz_id'],
-            question_text=data['question_text'],
-            option_a=data['option_a'],
-            option_b=data['option_b'],
-            option_c=data['option_c'],
-            option_d=data['option_d'],
-            correct_answer=data['correct_answer'],
-            question_order=max_order + 1,
-            time_bonus_factor=data.get('time_bonus_factor', 1.0)
-        )
-        
-        db.session.add(question)
-        
-        # Update quiz total questions count
-        quiz.total_questions = len(quiz.questions) + 1
-        
-        db.session.commit()
-        
-        return jsonify({
-            'success': True,
-            'data': question.to_dict(include_correct_answer=True),
-            'message': 'Question created successfully'
-        }), 201
-        
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'success': False, 'error': {'message': str(e)}}), 500
+    data = request.get_json()
+    
+    if not data:
+        return jsonify({'success': False, 'error': {'message': 'No data provided'}}), 400
+    
+    required_fields = ['quiz_id', 'question_text', 'option_a', 'option_b', 'option_c', 'option_d', 'correct_answer']
+    for field in required_fields:
+        if not data.get(field):
+            return jsonify({'success': False, 'error': {'message': f'{field} is required'}}), 400
+    
+    # Validate correct answer
+    if data['correct_answer'] not in ['a', 'b', 'c', 'd']:
+        return jsonify({'success': False, 'error': {'message': 'Correct answer must be a, b, c, or d'}}), 400
+    
+    # Check if quiz exists
+    abort_unless_quiz_exists(data['quiz_id'])
+    
+    # Next question order is computed inside the INSERT itself, so it costs no
+    # extra round-trip and concurrent creates can't read the same max
+    next_order = select(
+        func.coalesce(func.max(Question.question_order), 0) + 1
+    ).where(Question.quiz_id == data['quiz_id']).scalar_subquery()
+    
+    question = Question(
+        quiz_id=data['quiz_id'],
+        question_text=data['question_text'],
+        option_a=data['option_a'],
+        option_b=data['option_b'],
+        option_c=data['option_c'],
+        option_d=data['option_d'],
+        correct_answer=data['correct_answer'],
+        question_order=next_order,
+        time_bonus_factor=data.get('time_bonus_factor', 1.0)
+    )
+    
+    db.session.add(question)
+    
+    # Update quiz total questions count and version in the DB, without loading the collection
+    Quiz.bump_version(data['quiz_id'], total_questions=Quiz.total_questions + 1)
+    QuestionAnalyticsRollup.create_missing(quiz_id=data['quiz_id'])
+    
+    db.session.commit()
+    
+    return jsonify({
+        'success': True,
+        'data': question.to_dict(include_correct_answer=True),
+        'message': 'Question created successfully'
+    }), 201
 
 @quiz_bp.route('/admin/questions/<int:question_id>', methods=['PUT'])
+@json_route
 @token_required
 @admin_required
 def update_question(current_user, question_id):
     """Update question (admin only)"""
-    try:
-        question = Question.query.get_or_404(question_id)
-        data = request.get_json()
-        
-        if not data:
-            return jsonify({'success': False, 'error': {'message': 'No data provided'}}), 400
-        
-        # Update allowed fields
-        if 'question_text' in data:
-            question.question_text = data['question_text']
-        if 'option_a' in data:
-            question.option_a = data['option_a']
-        if 'option_b' in data:
-            question.option_b = data['option_b']
-        if 'option_c' in data:
-            question.option_c = data['option_c']
-        if 'option_d' in data:
-            question.option_d = data['option_d']
-        if 'correct_answer' in data:
-            if data['correct_answer'] not in ['a', 'b', 'c', 'd']:
-                return jsonify({'success': False, 'error': {'message': 'Correct answer must be a, b, c, or d'}}), 400
-            question.correct_answer = data['correct_answer']
-        if 'question_order' in data:
-            question.question_order = data['question_order']
-        if 'time_bonus_factor' in data:
-            question.time_bonus_factor = data['time_bonus_factor']
-        
-        # Clear image paths if text changed (will be regenerated)
-        if any(field in data for field in ['question_text', 'option_a', 'option_b', 'option_c', 'option_d']):
-            question.question_image_path = None
-            question.options_image_path = None
-        
-        db.session.commit()
-        
-        return jsonify({
-            'success': True,
-            'data': question.to_dict(include_correct_answer=True),
-            'message': 'Question updated successfully'
-        }), 200
-        
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'success': False, 'error': {'message': str(e)}}), 500
+    data = request.get_json()
+    
+    if not data:
+        return jsonify({'success': False, 'error': {'message': 'No data provided'}}), 400
+    
+    if 'correct_answer' in data and data['correct_answer'] not in ['a', 'b', 'c', 'd']:
+        return jsonify({'success': False, 'error': {'message': 'Correct answer must be a, b, c, or d'}}), 400
+    
+    # Update allowed fields
+    updates = {field: data[field] for field in QUESTION_UPDATE_FIELDS if field in data}
+    
+    # Clear image paths if text changed (will be regenerated)
+    if any(field in data for field in QUESTION_TEXT_FIELDS):
+        updates['question_image_path'] = None
+        updates['options_image_path'] = None
+    
+    # One UPDATE ... RETURNING instead of loading the row first
+    if updates:
+        statement = update(Question).where(Question.id == question_id).values(**updates).returning(*QUESTION_COLUMNS)
+    else:
+        statement = select(*QUESTION_COLUMNS).where(Question.id == question_id)
+    question = db.session.execute(statement).first()
+    if question is None:
+        abort(404)
+    
+    if updates:
+        Quiz.bump_version(question.quiz_id)
+    db.session.commit()
+    
+    return jsonify({
+        'success': True,
+        'data': Question.serialize(question, include_correct_answer=True),
+        'message': 'Question updated successfully'
+    }), 200
 
 @quiz_bp.route('/admin/questions/<int:question_id>', methods=['DELETE'])
+@json_route
 @token_required
 @admin_required
 def delete_question(current_user, question_id):
     """Delete question (admin only)"""
-    try:
-        question = Question.query.get_or_404(question_id)
-        quiz = question.quiz
-        
-        db.session.delete(question)
-        
-        # Update quiz total questions count
-        quiz.total_questions = len(quiz.questions) - 1
-        
-        db.session.commit()
-        
-        return jsonify({
-            'success': True,
-            'message': 'Question deleted successfully'
-        }), 200
-        
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'success': False, 'error': {'message': str(e)}}), 500
+    question = Question.query.get_or_404(question_id)
+    quiz_id = question.quiz_id
+    
+    db.session.execute(delete(QuestionAnalyticsRollup).where(QuestionAnalyticsRollup.question_id == question_id))
+    db.session.delete(question)
+    
+    # Update quiz total questions count and version in the DB, without loading the collection
+    Quiz.bump_version(quiz_id, total_questions=Quiz.total_questions - 1)
+    
+    db.session.commit()
+    
+    return jsonify({
+        'success': True,
+        'message': 'Question deleted successfully'
+    }), 200
 
 @quiz_bp.route('/admin/quizzes/<int:quiz_id>/upload', methods=['POST'])
+@json_route
 @token_required
 @admin_required
 def bulk_upload_questions(current_user, quiz_id):
     """Bulk upload questions from CSV (admin only)"""
-    try:
-        quiz = Quiz.query.get_or_404(quiz_id)
-        
-        if 'file' not in request.files:
-            return jsonify({'success': False, 'error': {'message': 'No file provided'}}), 400
-        
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({'success': False, 'error': {'message': 'No file selected'}}), 400
-        
-        if not file.filename.endswith('.csv'):
-            return jsonify({'success': False, 'error': {'message': 'Only CSV files are supported'}}), 400
-        
-        # Read CSV content
-        stream = io.StringIO(file.stream.read().decode("UTF8"), newline=None)
-        csv_input = csv.DictReader(stream)
-        
-        questions_created = 0
-        errors = []
-        
-        # Get current max order
-        max_order = db.session.query(db.func.max(Question.question_order)).filter_by(quiz_id=quiz_id).scalar() or 0
-        
-        for row_num, row in enumerate(csv_input, start=2):  # Start at 2 because row 1 is header
-            try:
-                # Validate required fields
-                required_fields = ['question_text', 'option_a', 'option_b', 'option_c', 'option_d', 'correct_answer']
-                missing_fields = [field for field in required_fields if not row.get(field, '').strip()]
-                
-                if missing_fields:
-                    errors.append(f"Row {row_num}: Missing fields: {', '.join(missing_fields)}")
-                    continue
-                
-                # Validate correct answer
-                correct_answer = row['correct_answer'].strip().lower()
-                if correct_answer not in ['a', 'b', 'c', 'd']:
-                    errors.append(f"Row {row_num}: Correct answer must be a, b, c, or d")
-                    continue
-                
-                max_order += 1
-                
-                question = Question(
-                    quiz_id=quiz_id,
-                    question_text=row['question_text'].strip(),
-                    option_a=row['option_a'].strip(),
-                    option_b=row['option_b'].strip(),
-                    option_c=row['option_c'].strip(),
-                    option_d=row['option_d'].strip(),
-                    correct_answer=correct_answer,
-                    question_order=max_order,
-                    time_bonus_factor=float(row.get('time_bonus_factor', 1.0))
-                )
-                
-                db.session.add(question)
-                questions_created += 1
-                
-            except Exception as e:
-                errors.append(f"Row {row_num}: {str(e)}")
-        
-        if questions_created > 0:
-            # Update quiz total questions count
-            quiz.total_questions = len(quiz.questions) + questions_created
-            db.session.commit()
-        
-        return jsonify({
-            'success': True,
-            'data': {
-                'questions_created': questions_created,
-                'errors': errors
-            },
-            'message': f'Bulk upload completed. {questions_created} questions created.'
-        }), 200
-        
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'success': False, 'error': {'message': str(e)}}), 500
+    abort_unless_quiz_exists(quiz_id)
+    
+    if 'file' not in request.files:
+        return jsonify({'success': False, 'error': {'message': 'No file provided'}}), 400
+    
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({'success': False, 'error': {'message': 'No file selected'}}), 400
+    
+    if not file.filename.endswith('.csv'):
+        return jsonify({'success': False, 'error': {'message': 'Only CSV files are supported'}}), 400
+    
+    # Parse CSV rows lazily from the upload stream instead of decoding it all up front
+    stream = io.TextIOWrapper(file.stream, encoding='utf-8', newline='')
+    csv_input = csv.DictReader(stream)
+    
+    questions_created = 0
+    errors = []
+    pending_rows = []
+    
+    # Get current max order
+    max_order = db.session.query(db.func.max(Question.question_order)).filter_by(quiz_id=quiz_id).scalar() or 0
+    
+    for row_num, row in enumerate(csv_input, start=2):  # Start at 2 because row 1 is header
+        try:
+            # Validate required fields
+            required_fields = ['question_text', 'option_a', 'option_b', 'option_c', 'option_d', 'correct_answer']
+            missing_fields = [field for field in required_fields if not row.get(field, '').strip()]
+            
+            if missing_fields:
+                errors.append(f"Row {row_num}: Missing fields: {', '.join(missing_fields)}")
+                continue
+            
+            # Validate correct answer
+            correct_answer = row['correct_answer'].strip().lower()
+            if correct_answer not in ['a', 'b', 'c', 'd']:
+                errors.append(f"Row {row_num}: Correct answer must be a, b, c, or d")
+                continue
+            
+            max_order += 1
+            
+            pending_rows.append({
+                'quiz_id': quiz_id,
+                'question_text': row['question_text'].strip(),
+                'option_a': row['option_a'].strip(),
+                'option_b': row['option_b'].strip(),
+                'option_c': row['option_c'].strip(),
+                'option_d': row['option_d'].strip(),
+                'correct_answer': correct_answer,
+                'question_order': max_order,
+                'time_bonus_factor': float(row.get('time_bonus_factor', 1.0))
+            })
+            questions_created += 1
+            
+        except Exception as e:
+            errors.append(f"Row {row_num}: {str(e)}")
+            continue
+        
+        # Insert in executemany batches rather than one ORM object per row
+        if len(pending_rows) >= BULK_INSERT_BATCH_SIZE:
+            db.session.execute(insert(Question), pending_rows)
+            pending_rows = []
+    
+    if pending_rows:
+        db.session.execute(insert(Question), pending_rows)
+    
+    if questions_created > 0:
+        # Update quiz total questions count and version in the DB, without loading the collection
+        Quiz.bump_version(quiz_id, total_questions=Quiz.total_questions + questions_created)
+        QuestionAnalyticsRollup.create_missing(quiz_id=quiz_id)
+        db.session.commit()
+    
+    return jsonify({
+        'success': True,
+        'data': {
+            'questions_created': questions_created,
+            'errors': errors
+        },
+        'message': f'Bulk upload completed. {questions_created} questions created.'
+    }), 200
 
@@ -1,11 +1,147 @@
 from flask import Blueprint, request, jsonify, current_app
-from src.models.user import db, User
+from src.models.user import db, User, dummy_check_password
+from src.services.cache_service import cache_service, ADMIN_STATS_CACHE_KEY, AUTH_USER_TTL, auth_user_cache_key
+from werkzeug.exceptions import HTTPException
+from sqlalchemy import select, func
 import jwt
-from datetime import datetime, timedelta
-from functools import wraps
+from jwt.utils import base64url_decode, base64url_encode
+from functools import wraps, lru_cache
+import binascii
+import hashlib
+import hmac
+import math
+import orjson
+import time
 
 user_bp = Blueprint('user', __name__)
 
+# Issued tokens are valid for a day
+TOKEN_LIFETIME_SECONDS = 24 * 60 * 60
+
+# Claims decode_token insists on; tokens without them are rejected as invalid
+REQUIRED_TOKEN_CLAIMS = ('exp', 'user_id')
+
+# Every token carries the same header, so its encoded segment is built once
+TOKEN_HEADER_SEGMENT = base64url_encode(orjson.dumps({'alg': 'HS256', 'typ': 'JWT'})).decode()
+
+# Upper bound for page sizes on list endpoints
+MAX_PER_PAGE = 100
+
+# Column-only select for the user list; password_hash never leaves the database
+USER_COLUMNS = (User.id, User.username, User.email, User.role, User.created_at, User.is_active)
+
+def paginate_rows(statement, page, per_page):
+    """Page through a column-only SELECT, returning (rows, total, pages)"""
+    page = max(page, 1)
+    per_page = max(per_page, 1)
+    total = db.session.execute(
+        select(func.count()).select_from(statement.order_by(None).subquery())
+    ).scalar()
+    rows = db.session.execute(statement.limit(per_page).offset((page - 1) * per_page)).all()
+    pages = math.ceil(total / per_page) if total else 0
+    return rows, total, pages
+
+class AuthenticatedUser:
+    """Read-only stand-in for the requesting User, built from its cached to_dict()"""
+
+    def __init__(self, data):
+        self._data = data
+        self.id = data['id']
+        self.username = data['username']
+        self.email = data['email']
+        self.role = data['role']
+        self.is_active = data['is_active']
+
+    def is_admin(self):
+        """Check if user has admin role"""
+        return self.role == 'admin'
+
+    def to_dict(self):
+        return dict(self._data)
+
+def load_active_user(user_id):
+    """Resolve a token's user id to an AuthenticatedUser, or None if unknown/deactivated"""
+    cache_key = auth_user_cache_key(user_id)
+    data = cache_service.get_json(cache_key)
+    if data is None:
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        data = user.to_dict()
+        cache_service.set_json(cache_key, data, AUTH_USER_TTL)
+    
+    if not data['is_active']:
+        return None
+    return AuthenticatedUser(data)
+
+@lru_cache(maxsize=4)
+def token_mac(secret_key):
+    """HMAC-SHA256 state keyed with the signing secret; copies skip the per-call key setup"""
+    return hmac.new(secret_key.encode(), digestmod=hashlib.sha256)
+
+def token_signature(signing_input, secret_key=None):
+    """HS256 signature of '<header>.<payload>' under secret_key, by default the app's SECRET_KEY"""
+    if secret_key is None:
+        secret_key = current_app.config['SECRET_KEY']
+    mac = token_mac(secret_key).copy()
+    mac.update(signing_input.encode())
+    return mac.digest()
+
+def encode_token(claims):
+    """Sign claims as an HS256 JWT, without PyJWT's per-call algorithm lookup and key preparation"""
+    signing_input = f'{TOKEN_HEADER_SEGMENT}.{base64url_encode(orjson.dumps(claims)).decode()}'
+    return f'{signing_input}.{base64url_encode(token_signature(signing_input)).decode()}'
+
+def decode_token(token, secret_key=None):
+    """Verify an HS256 JWT and return its claims, raising the same errors as jwt.decode"""
+    try:
+        header_segment, payload_segment, signature_segment = token.split('.')
+        header = orjson.loads(base64url_decode(header_segment))
+        signature = base64url_decode(signature_segment)
+    except (ValueError, binascii.Error):
+        raise jwt.DecodeError('Invalid token')
+    
+    if not isinstance(header, dict) or header.get('alg') != 'HS256':
+        raise jwt.InvalidAlgorithmError('The specified alg value is not allowed')
+    
+    if not hmac.compare_digest(token_signature(f'{header_segment}.{payload_segment}', secret_key), signature):
+        raise jwt.InvalidSignatureError('Signature verification failed')
+    
+    try:
+        claims = orjson.loads(base64url_decode(payload_segment))
+    except (ValueError, binascii.Error):
+        raise jwt.DecodeError('Invalid payload')
+    if not isinstance(claims, dict):
+        raise jwt.DecodeError('Invalid payload')
+    
+    for claim in REQUIRED_TOKEN_CLAIMS:
+        if claim not in claims:
+            raise jwt.MissingRequiredClaimError(claim)
+    
+    exp = claims['exp']
+    if not isinstance(exp, (int, float)):
+        raise jwt.DecodeError('Expiration Time claim (exp) must be an integer')
+    if exp <= time.time():
+        raise jwt.ExpiredSignatureError('Signature has expired')
+    return claims
+
+def json_route(f):
+    """Decorator turning unexpected errors into the standard JSON 500 response"""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        try:
+            return f(*args, **kwargs)
+        except HTTPException:
+            # abort(404) and friends go through the app's error handlers
+            raise
+        except Exception as e:
+            # Never leave a failed transaction on the scoped session
+            db.session.rollback()
+            current_app.logger.exception('Unhandled error in %s', request.path)
+            return jsonify({'success': False, 'error': {'message': str(e)}}), 500
+    
+    return decorated
+
 def token_required(f):
     """Decorator to require JWT token for protected routes"""
     @wraps(f)
@@ -20,10 +156,11 @@ def token_required(f):
             if token.startswith('Bearer '):
                 token = token[7:]
             
-            data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])
-            current_user = User.query.get(data['user_id'])
+            data = decode_token(token)
+            # The signature and expiry are checked every time; only the user row is cached
+            current_user = load_active_user(data['user_id'])
             
-            if not current_user or not current_user.is_active:
+            if not current_user:
                 return jsonify({'success': False, 'error': {'message': 'Invalid token'}}), 401
                 
         except jwt.ExpiredSignatureError:
@@ -46,95 +183,97 @@ def admin_required(f):
     return decorated
 
 @user_bp.route('/auth/register', methods=['POST'])
+@json_route
 def register():
     """User registration endpoint"""
-    try:
-        data = request.get_json()
-        
-        if not data:
-            return jsonify({'success': False, 'error': {'message': 'No data provided'}}), 400
-        
-        username = data.get('username', '').strip()
-        email = data.get('email', '').strip()
-        password = data.get('password', '')
-        role = data.get('role', 'user')
-        
-        # Validation
-        if not username or not email or not password:
-            return jsonify({'success': False, 'error': {'message': 'Username, email, and password are required'}}), 400
-        
-        if len(password) < 6:
-            return jsonify({'success': False, 'error': {'message': 'Password must be at least 6 characters'}}), 400
-        
-        # Check if user already exists
-        if User.query.filter_by(username=username).first():
-            return jsonify({'success': False, 'error': {'message': 'Username already exists'}}), 400
-        
-        if User.query.filter_by(email=email).first():
-            return jsonify({'success': False, 'error': {'message': 'Email already exists'}}), 400
-        
-        # Create new user
-        user = User(username=username, email=email, role=role)
-        user.set_password(password)
-        
-        db.session.add(user)
-        db.session.commit()
-        
-        return jsonify({
-            'success': True,
-            'data': user.to_dict(),
-            'message': 'User registered successfully'
-        }), 201
-        
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'success': False, 'error': {'message': str(e)}}), 500
+    data = request.get_json()
+    
+    if not data:
+        return jsonify({'success': False, 'error': {'message': 'No data provided'}}), 400
+    
+    username = data.get('username', '').strip()
+    email = data.get('email', '').strip()
+    password = data.get('password', '')
+    role = data.get('role', 'user')
+    
+    # Validation
+    if not username or not email or not password:
+        return jsonify({'success': False, 'error': {'message': 'Username, email, and password are required'}}), 400
+    
+    if len(password) < 6:
+        return jsonify({'success': False, 'error': {'message': 'Password must be at least 6 characters'}}), 400
+    
+    # Check if user already exists
+    if User.query.filter_by(username=username).first():
+        return jsonify({'success': False, 'error': {'message': 'Username already exists'}}), 400
+    
+    if User.query.filter_by(email=email).first():
+        return jsonify({'success': False, 'error': {'message': 'Email already exists'}}), 400
+    
+    # Create new user
+    user = User(username=username, email=email, role=role)
+    user.set_password(password)
+    
+    db.session.add(user)
+    db.session.commit()
+    cache_service.delete(ADMIN_STATS_CACHE_KEY)
+    
+    return jsonify({
+        'success': True,
+        'data': user.to_dict(),
+        'message': 'User registered successfully'
+    }), 201
 
 @user_bp.route('/auth/login', methods=['POST'])
+@json_route
 def login():
     """User login endpoint"""
-    try:
-        data = request.get_json()
-        
-        if not data:
-            return jsonify({'success': False, 'error': {'message': 'No data provided'}}), 400
-        
-        username = data.get('username', '').strip()
-        password = data.get('password', '')
-        
-        if not username or not password:
-            return jsonify({'success': False, 'error': {'message': 'Username and password are required'}}), 400
-        
-        # Find user by username or email
-        user = User.query.filter(
-            (User.username == username) | (User.email == username)
-        ).first()
-        
-        if not user or not user.check_password(password):
-            return jsonify({'success': False, 'error': {'message': 'Invalid credentials'}}), 401
-        
-        if not user.is_active:
-            return jsonify({'success': False, 'error': {'message': 'Account is deactivated'}}), 401
-        
-        # Generate JWT token
-        token = jwt.encode({
-            'user_id': user.id,
-            'username': user.username,
-            'role': user.role,
-            'exp': datetime.utcnow() + timedelta(hours=24)
-        }, current_app.config['SECRET_KEY'], algorithm='HS256')
-        
-        return jsonify({
-            'success': True,
-            'data': {
-                'user': user.to_dict(),
-                'token': token
-            },
-            'message': 'Login successful'
-        }), 200
-        
-    except Exception as e:
-        return jsonify({'success': False, 'error': {'message': str(e)}}), 500
+    data = request.get_json()
+    
+    if not data:
+        return jsonify({'success': False, 'error': {'message': 'No data provided'}}), 400
+    
+    username = data.get('username', '').strip()
+    password = data.get('password', '')
+    
+    if not username or not password:
+        return jsonify({'success': False, 'error': {'message': 'Username and password are required'}}), 400
+    
+    # Find user by username or email
+    user = User.query.filter(
+        (User.username == username) | (User.email == username)
+    ).first()
+    
+    # Hash the password even for unknown users so timing doesn't reveal which accounts exist
+    password_ok = user.check_password(password) if user else dummy_check_password(password)
+    
+    if not password_ok:
+        return jsonify({'success': False, 'error': {'message': 'Invalid credentials'}}), 401
+    
+    if not user.is_active:
+        return jsonify({'success': False, 'error': {'message': 'Account is deactivated'}}), 401
+    
+    # Upgrade legacy hashes now that we have the plaintext
+    if user.password_needs_rehash():
+        user.set_password(password)
+        db.session.commit()
+    
+    # Generate JWT token
+    token = encode_token({
+        'user_id': user.id,
+        'username': user.username,
+        'role': user.role,
+        'exp': int(time.time()) + TOKEN_LIFETIME_SECONDS
+    })
+    
+    return jsonify({
+        'success': True,
+        'data': {
+            'user': user.to_dict(),
+            'token': token
+        },
+        'message': 'Login successful'
+    }), 200
 
 @user_bp.route('/auth/me', methods=['GET'])
 @token_required
@@ -156,121 +295,107 @@ def logout(current_user):
     }), 200
 
 @user_bp.route('/users', methods=['GET'])
+@json_route
 @token_required
 @admin_required
 def get_users(current_user):
     """Get all users (admin only)"""
-    try:
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
-        
-        users = User.query.paginate(
-            page=page, per_page=per_page, error_out=False
-        )
-        
-        return jsonify({
-            'success': True,
-            'data': {
-                'users': [user.to_dict() for user in users.items],
-                'pagination': {
-                    'page': page,
-                    'per_page': per_page,
-                    'total': users.total,
-                    'pages': users.pages
-                }
-            },
-            'message': 'Users retrieved successfully'
-        }), 200
-        
-    except Exception as e:
-        return jsonify({'success': False, 'error': {'message': str(e)}}), 500
+    page = request.args.get('page', 1, type=int)
+    per_page = min(request.args.get('per_page', 20, type=int), MAX_PER_PAGE)
+    
+    rows, total, pages = paginate_rows(select(*USER_COLUMNS).order_by(User.id), page, per_page)
+    
+    return jsonify({
+        'success': True,
+        'data': {
+            'users': [User.serialize(row) for row in rows],
+            'pagination': {
+                'page': page,
+                'per_page': per_page,
+                'total': total,
+                'pages': pages
+            }
+        },
+        'message': 'Users retrieved successfully'
+    }), 200
 
 @user_bp.route('/users/<int:user_id>', methods=['GET'])
+@json_route
 @token_required
 @admin_required
 def get_user(current_user, user_id):
     """Get specific user (admin only)"""
-    try:
-        user = User.query.get_or_404(user_id)
-        
-        return jsonify({
-            'success': True,
-            'data': user.to_dict(),
-            'message': 'User retrieved successfully'
-        }), 200
-        
-    except Exception as e:
-        return jsonify({'success': False, 'error': {'message': str(e)}}), 500
+    user = User.query.get_or_404(user_id)
+    
+    return jsonify({
+        'success': True,
+        'data': user.to_dict(),
+        'message': 'User retrieved successfully'
+    }), 200
 
 @user_bp.route('/users/<int:user_id>', methods=['PUT'])
+@json_route
 @token_required
 @admin_required
 def update_user(current_user, user_id):
     """Update user (admin only)"""
-    try:
-        user = User.query.get_or_404(user_id)
-        data = request.get_json()
-        
-        if not data:
-            return jsonify({'success': False, 'error': {'message': 'No data provided'}}), 400
-        
-        # Update allowed fields
-        if 'username' in data:
-            username = data['username'].strip()
-            if username != user.username:
-                if User.query.filter_by(username=username).first():
-                    return jsonify({'success': False, 'error': {'message': 'Username already exists'}}), 400
-                user.username = username
-        
-        if 'email' in data:
-            email = data['email'].strip()
-            if email != user.email:
-                if User.query.filter_by(email=email).first():
-                    return jsonify({'success': False, 'error': {'message': 'Email already exists'}}), 400
-                user.email = email
-        
-        if 'role' in data:
-            user.role = data['role']
-        
-        if 'is_active' in data:
-            user.is_active = data['is_active']
-        
-        if 'password' in data and data['password']:
-            user.set_password(data['password'])
-        
-        db.session.commit()
-        
-        return jsonify({
-            'success': True,
-            'data': user.to_dict(),
-            'message': 'User updated successfully'
-        }), 200
-        
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'success': False, 'error': {'message': str(e)}}), 500
+    user = User.query.get_or_404(user_id)
+    data = request.get_json()
+    
+    if not data:
+        return jsonify({'success': False, 'error': {'message': 'No data provided'}}), 400
+    
+    # Update allowed fields
+    if 'username' in data:
+        username = data['username'].strip()
+        if username != user.username:
+            if User.query.filter_by(username=username).first():
+                return jsonify({'success': False, 'error': {'message': 'Username already exists'}}), 400
+            user.username = username
+    
+    if 'email' in data:
+        email = data['email'].strip()
+        if email != user.email:
+            if User.query.filter_by(email=email).first():
+                return jsonify({'success': False, 'error': {'message': 'Email already exists'}}), 400
+            user.email = email
+    
+    if 'role' in data:
+        user.role = data['role']
+    
+    if 'is_active' in data:
+        user.is_active = data['is_active']
+    
+    if 'password' in data and data['password']:
+        user.set_password(data['password'])
+    
+    db.session.commit()
+    cache_service.delete(auth_user_cache_key(user.id))
+    
+    return jsonify({
+        'success': True,
+        'data': user.to_dict(),
+        'message': 'User updated successfully'
+    }), 200
 
 @user_bp.route('/users/<int:user_id>', methods=['DELETE'])
+@json_route
 @token_required
 @admin_required
 def delete_user(current_user, user_id):
     """Delete user (admin only)"""
-    try:
-        user = User.query.get_or_404(user_id)
-        
-        # Prevent admin from deleting themselves
-        if user.id == current_user.id:
-            return jsonify({'success': False, 'error': {'message': 'Cannot delete your own account'}}), 400
-        
-        # Soft delete by deactivating
-        user.is_active = False
-        db.session.commit()
-        
-        return jsonify({
-            'success': True,
-            'message': 'User deactivated successfully'
-        }), 200
-        
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'success': False, 'error': {'message': str(e)}}), 500
\ No newline at end of file
+    user = User.query.get_or_404(user_id)
+    
+    # Prevent admin from deleting themselves
+    if user.id == current_user.id:
+        return jsonify({'success': False, 'error': {'message': 'Cannot delete your own account'}}), 400
+    
+    # Soft delete by deactivating
+    user.is_active = False
+    db.session.commit()
+    cache_service.delete(auth_user_cache_key(user.id))
+    
+    return jsonify({
+        'success': True,
+        'message': 'User deactivated successfully'
+    }), 200
\ No newline at end of file
@@ -0,0 +1,157 @@
+import os
+import time
+import threading
+import orjson
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+class CacheService:
+    """Small key/value cache with TTLs, backed by Redis when REDIS_URL is set"""
+
+    def __init__(self, redis_url=None):
+        self.redis = None
+        if redis_url and redis is not None:
+            pool = redis.ConnectionPool.from_url(redis_url)
+            self.redis = redis.Redis(connection_pool=pool)
+
+        # In-process fallback: key -> (expires_at, value)
+        self._local = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Get a cached string, or None if missing/expired"""
+        if self.redis is not None:
+            try:
+                value = self.redis.get(key)
+                return value.decode() if value is not None else None
+            except redis.RedisError:
+                return None
+
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._local[key]
+                return None
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        """Cache a string for ttl seconds"""
+        if self.redis is not None:
+            try:
+                self.redis.setex(key, ttl, value)
+            except redis.RedisError:
+                pass
+            return
+
+        with self._lock:
+            self._local[key] = (time.monotonic() + ttl, value)
+
+    def delete(self, *keys):
+        """Drop keys from the cache"""
+        if self.redis is not None:
+            try:
+                self.redis.delete(*keys)
+            except redis.RedisError:
+                pass
+            return
+
+        with self._lock:
+            for key in keys:
+                self._local.pop(key, None)
+
+    def add_member(self, key, member, ttl):
+        """Add member to the set at key and (re)start the set's ttl"""
+        if self.redis is not None:
+            try:
+                self.redis.pipeline().sadd(key, member).expire(key, ttl).execute()
+            except redis.RedisError:
+                pass
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            entry = self._local.get(key)
+            members = entry[1] if entry is not None and entry[0] >= now else set()
+            members.add(member)
+            self._local[key] = (now + ttl, members)
+
+    def remove_member(self, key, member):
+        """Drop member from the set at key"""
+        if self.redis is not None:
+            try:
+                self.redis.srem(key, member)
+            except redis.RedisError:
+                pass
+            return
+
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is not None:
+                entry[1].discard(member)
+
+    def count_members(self, key):
+        """Size of the set at key, 0 if missing/expired"""
+        if self.redis is not None:
+            try:
+                return self.redis.scard(key)
+            except redis.RedisError:
+                return 0
+
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                return 0
+            return len(entry[1])
+
+    def get_json(self, key):
+        """Get a cached JSON value"""
+        value = self.get(key)
+        return orjson.loads(value) if value is not None else None
+
+    def set_json(self, key, value, ttl):
+        """Cache a JSON-serializable value"""
+        self.set(key, orjson.dumps(value).decode(), ttl)
+
+# Cache keys shared across blueprints
+ADMIN_STATS_CACHE_KEY = 'admin:stats'
+ADMIN_STATS_TTL = 120
+
+# Authenticated user lookups; short TTL bounds staleness on workers that missed an invalidation
+AUTH_USER_TTL = 60
+
+def auth_user_cache_key(user_id):
+    """Cache key for the user record token_required resolves a JWT to"""
+    return f'auth:user:{user_id}'
+
+# Question lists served to quiz takers; the key carries the quiz version, so edits switch keys instead of deleting
+QUIZ_QUESTIONS_TTL = 3600
+
+def quiz_questions_cache_key(quiz_id, version):
+    """Cache key for a quiz's question list (without correct answers) at a given version"""
+    return f'quiz:{quiz_id}:v{version}:questions'
+
+# Websocket state, shared by every Socket.IO worker; entries expire SOCKET_STATE_GRACE seconds after the quiz would end
+SOCKET_STATE_GRACE = 300
+
+def socket_session_cache_key(sid):
+    """Cache key for the quiz session a websocket connection joined"""
+    return f'ws:session:{sid}'
+
+def quiz_room_cache_key(quiz_id):
+    """Cache key for the set of websocket connections in a quiz room"""
+    return f'qr:{quiz_id}'
+
+# Marks a session whose websocket answers are queued on some worker but not yet written
+PENDING_ANSWERS_TTL = 60
+
+def pending_answers_cache_key(session_id):
+    """Cache key marking a session with queued, unwritten websocket answers"""
+    return f'ws:pending:{session_id}'
+
+# Shared by all blueprints so invalidation in one route is seen by the others
+cache_service = CacheService(os.environ.get('REDIS_URL'))
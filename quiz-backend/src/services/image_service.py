@@ -1,8 +1,99 @@
 import os
 import hashlib
+import logging
+import tempfile
 from PIL import Image, ImageDraw, ImageFont
-import textwrap
 from datetime import datetime
+from functools import lru_cache
+
+try:
+    from eventlet import patcher, tpool
+except ImportError:
+    tpool = None
+
+logger = logging.getLogger(__name__)
+
+# Generated images are lossless WebP: flat text renders come out ~6x smaller than PNG.
+# method 1 / quality 50 is the cheapest effort that still finds that size (about as fast as PNG level 1)
+WEBP_METHOD = 1
+WEBP_QUALITY = 50
+
+def run_blocking(fn, *args, **kwargs):
+    """Run a blocking call on a real OS thread when eventlet has patched threading"""
+    # Under eventlet a stdlib thread is a green thread, so Pillow's encode would stall
+    # every other socket on the worker; tpool hands it to eventlet's native thread pool
+    if tpool is not None and patcher.is_monkey_patched('thread'):
+        return tpool.execute(fn, *args, **kwargs)
+    return fn(*args, **kwargs)
+
+@lru_cache(maxsize=16)
+def load_font(size):
+    """Get font with fallback to default, parsed once per size"""
+    try:
+        # Try to use a system font
+        return ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", size)
+    except:
+        try:
+            # Fallback to another common font
+            return ImageFont.truetype("/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf", size)
+        except:
+            # Use default font as last resort
+            return ImageFont.load_default()
+
+# Per-font character advances, filled in as characters are first seen
+char_widths = {}
+
+def measure_text(font, text):
+    """Width of text summed from cached character advances (ignores kerning)"""
+    widths = char_widths.setdefault(font, {})
+    total = 0
+    for char in text:
+        width = widths.get(char)
+        if width is None:
+            width = widths[char] = font.getlength(char)
+        total += width
+    return total
+
+@lru_cache(maxsize=1024)
+def wrap_text(text, font, max_width):
+    """Greedily split text into lines no wider than max_width; returns (lines, widest line's width)"""
+    space_width = measure_text(font, ' ')
+    lines = []
+    widest = 0
+    line, line_width = '', 0
+    for word in text.split():
+        word_width = measure_text(font, word)
+        if line and line_width + space_width + word_width <= max_width:
+            line += ' ' + word
+            line_width += space_width + word_width
+            continue
+        if line:
+            lines.append(line)
+            widest = max(widest, line_width)
+        
+        # A word wider than a whole line is broken across lines
+        while word_width > max_width and len(word) > 1:
+            cut, cut_width = 0, 0
+            for char in word:
+                char_width = measure_text(font, char)
+                if cut and cut_width + char_width > max_width:
+                    break
+                cut += 1
+                cut_width += char_width
+            lines.append(word[:cut])
+            widest = max(widest, cut_width)
+            word, word_width = word[cut:], word_width - cut_width
+        line, line_width = word, word_width
+    if line:
+        lines.append(line)
+        widest = max(widest, line_width)
+    return tuple(lines), widest
+
+@lru_cache(maxsize=4096)
+def line_height(font, line):
+    """Ink height of one rendered line"""
+    bbox = font.getbbox(line)
+    return bbox[3] - bbox[1]
 
 class ImageService:
     def __init__(self, images_dir=None):
@@ -12,8 +103,12 @@ class ImageService:
             self.images_dir = os.path.join(base_dir, 'static', 'images')
         else:
             self.images_dir = images_dir
+        # One stored render per distinct options set, hard-linked to each question's filename
+        self.renders_dir = os.path.join(self.images_dir, 'renders')
         self.ensure_images_directory()
         
+        self.image_url_prefix = '/api/images/'
+        
         # Default settings
         self.default_width = 800
         self.default_height = 600
@@ -30,71 +125,132 @@ class ImageService:
             'watermark': 14
         }
         
+        # (text, mask, bbox) of the current day's watermark
+        self._watermark_cache = (None, None, None)
+        
     def ensure_images_directory(self):
         """Ensure the images directory exists"""
         os.makedirs(self.images_dir, exist_ok=True)
+        os.makedirs(self.renders_dir, exist_ok=True)
         
     def get_font(self, size):
         """Get font with fallback to default"""
-        try:
-            # Try to use a system font
-            return ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", size)
-        except:
-            try:
-                # Fallback to another common font
-                return ImageFont.truetype("/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf", size)
-            except:
-                # Use default font as last resort
-                return ImageFont.load_default()
+        return load_font(size)
     
     def calculate_text_dimensions(self, text, font, max_width):
         """Calculate the dimensions needed for wrapped text"""
-        lines = textwrap.wrap(text, width=max_width // (font.size // 2))
+        lines, max_line_width = wrap_text(text, font, max_width)
         
         # Calculate total height
         total_height = 0
-        max_line_width = 0
         
         for line in lines:
-            bbox = font.getbbox(line)
-            line_width = bbox[2] - bbox[0]
-            line_height = bbox[3] - bbox[1]
-            
-            max_line_width = max(max_line_width, line_width)
-            total_height += line_height + self.line_spacing
+            total_height += line_height(font, line) + self.line_spacing
         
         return max_line_width, total_height, lines
     
-    def draw_wrapped_text(self, draw, text, font, x, y, max_width, color):
-        """Draw wrapped text and return the final y position"""
-        lines = textwrap.wrap(text, width=max_width // (font.size // 2))
+    def draw_wrapped_text(self, draw, text, font, x, y, max_width, color, lines=None):
+        """Draw wrapped text and return the final y position; pass lines from calculate_text_dimensions to skip wrapping"""
+        if lines is None:
+            lines, _ = wrap_text(text, font, max_width)
         current_y = y
         
         for line in lines:
             draw.text((x, current_y), line, font=font, fill=color)
-            bbox = font.getbbox(line)
-            line_height = bbox[3] - bbox[1]
-            current_y += line_height + self.line_spacing
+            current_y += line_height(font, line) + self.line_spacing
         
         return current_y
     
-    def add_watermark(self, draw, width, height):
+    def watermark_text(self):
+        """Today's watermark text"""
+        # Dates the render, not the view: reused renders keep the day they were drawn, so
+        # filenames stay content-addressed and their immutable URLs never rotate
+        return f"Quiz Platform - {datetime.now().strftime('%Y-%m-%d')}"
+    
+    def watermark_mask(self):
+        """Today's watermark text rasterized as a mask, rendered once per day"""
+        watermark_text = self.watermark_text()
+        cached_text, mask, bbox = self._watermark_cache
+        if cached_text != watermark_text:
+            watermark_font = self.get_font(self.font_sizes['watermark'])
+            bbox = watermark_font.getbbox(watermark_text)
+            mask = Image.new('L', (bbox[2], bbox[3]))
+            ImageDraw.Draw(mask).text((0, 0), watermark_text, font=watermark_font, fill=255)
+            self._watermark_cache = (watermark_text, mask, bbox)
+        return mask, bbox
+    
+    def add_watermark(self, image):
         """Add watermark to the image"""
-        watermark_text = f"Quiz Platform - {datetime.now().strftime('%Y-%m-%d')}"
-        watermark_font = self.get_font(self.font_sizes['watermark'])
+        mask, bbox = self.watermark_mask()
         
         # Position watermark at bottom right
-        bbox = watermark_font.getbbox(watermark_text)
         text_width = bbox[2] - bbox[0]
         text_height = bbox[3] - bbox[1]
         
-        x = width - text_width - 20
-        y = height - text_height - 20
+        x = image.width - text_width - 20
+        y = image.height - text_height - 20
         
-        draw.text((x, y), watermark_text, font=watermark_font, fill=self.watermark_color)
+        # Same pixels draw.text would produce, without rasterizing the glyphs again
+        image.paste(self.watermark_color[:3], (x, y, x + mask.width, y + mask.height), mask)
+    
+    def save_image(self, image, filepath):
+        """Write the image atomically so a cached filename never points at a partial file"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.images_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                run_blocking(image.save, f, 'WEBP', lossless=True, method=WEBP_METHOD, quality=WEBP_QUALITY)
+            os.replace(tmp_path, filepath)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+    
+    def link_render(self, render_name, filepath):
+        """Hard-link a stored render to filepath; False if there is none (or links aren't supported)"""
+        try:
+            os.link(os.path.join(self.renders_dir, render_name), filepath)
+        except FileExistsError:
+            pass
+        except OSError:
+            return False
+        return True
+    
+    def render_name(self, filename):
+        """Name of the stored render behind an options image"""
+        return 'options_' + filename.rsplit('_', 1)[-1]
+    
+    def release_render(self, filename):
+        """Drop the stored render behind an options image once no question links to it"""
+        render_path = os.path.join(self.renders_dir, self.render_name(filename))
+        try:
+            if os.stat(render_path).st_nlink == 1:
+                os.remove(render_path)
+        except OSError:
+            pass
+    
+    def content_hash(self, *parts):
+        """Short digest identifying the rendered content"""
+        return hashlib.sha256('\0'.join(str(part) for part in parts).encode()).hexdigest()[:16]
+    
+    def question_image_filename(self, question_text, question_id):
+        """Filename a question image renders to, known before rendering"""
+        return f"question_{question_id}_{self.content_hash(question_id, question_text)}.webp"
+    
+    def options_image_filename(self, options, question_id):
+        """Filename an options image renders to, known before rendering"""
+        options_hash = self.content_hash(*(f"{key}={value}" for key, value in options.items()))
+        return f"options_{question_id}_{options_hash}.webp"
+    
+    def image_exists(self, filename):
+        """Whether a generated image is already on disk"""
+        return os.path.exists(os.path.join(self.images_dir, filename))
     
     def generate_question_image(self, question_text, question_id):
-        """Generate an image for a question"""
+        """Generate an image for a question, reusing an existing render of the same content"""
+        filename = self.question_image_filename(question_text, question_id)
+        filepath = os.path.join(self.images_dir, filename)
+        if os.path.exists(filepath):
+            return filename
+        
         font = self.get_font(self.font_sizes['question'])
         max_text_width = self.default_width - (2 * self.padding)
         
@@ -123,36 +279,38 @@ class ImageService:
         self.draw_wrapped_text(
             draw, question_text, font, 
             self.padding, question_y, 
-            max_text_width, self.text_color
+            max_text_width, self.text_color, lines
         )
         
         # Add watermark
-        self.add_watermark(draw, self.default_width, image_height)
-        
-        # Generate filename
-        text_hash = hashlib.md5(question_text.encode()).hexdigest()[:8]
-        filename = f"question_{question_id}_{text_hash}.png"
-        filepath = os.path.join(self.images_dir, filename)
+        self.add_watermark(image)
         
         # Save image
-        image.save(filepath, 'PNG', quality=95)
+        self.save_image(image, filepath)
         
         return filename
     
     def generate_options_image(self, options, question_id):
-        """Generate an image for question options"""
+        """Generate an image for question options, reusing an existing render of the same content"""
+        filename = self.options_image_filename(options, question_id)
+        filepath = os.path.join(self.images_dir, filename)
+        # Options images don't depend on the question, so questions sharing options share a render
+        render_name = self.render_name(filename)
+        if os.path.exists(filepath) or self.link_render(render_name, filepath):
+            return filename
+        
         font = self.get_font(self.font_sizes['option'])
         max_text_width = self.default_width - (2 * self.padding) - 60  # Space for option labels
         
         # Calculate total height needed
         total_height = self.padding * 2
-        option_heights = []
+        option_lines = []
         
         for key, option_text in options.items():
-            _, text_height, _ = self.calculate_text_dimensions(
+            _, text_height, lines = self.calculate_text_dimensions(
                 option_text, font, max_text_width
             )
-            option_heights.append(text_height)
+            option_lines.append(lines)
             total_height += text_height + 40  # Space between options
         
         # Create image
@@ -182,22 +340,18 @@ class ImageService:
             final_y = self.draw_wrapped_text(
                 draw, option_text, font,
                 option_x, current_y,
-                max_text_width, self.text_color
+                max_text_width, self.text_color, option_lines[i]
             )
             
             current_y = final_y + 20  # Space between options
         
         # Add watermark
-        self.add_watermark(draw, self.default_width, image_height)
-        
-        # Generate filename
-        options_text = ''.join(options.values())
-        text_hash = hashlib.md5(options_text.encode()).hexdigest()[:8]
-        filename = f"options_{question_id}_{text_hash}.png"
-        filepath = os.path.join(self.images_dir, filename)
+        self.add_watermark(image)
         
         # Save image
-        image.save(filepath, 'PNG', quality=95)
+        self.save_image(image, os.path.join(self.renders_dir, render_name))
+        if not self.link_render(render_name, filepath):
+            self.save_image(image, filepath)
         
         return filename
     
@@ -234,27 +388,32 @@ class ImageService:
                 'error': str(e)
             }
     
-    def delete_question_images(self, question):
-        """Delete existing images for a question"""
+    def delete_question_images(self, question, keep=()):
+        """Delete existing images for a question, except filenames listed in keep"""
+        return self.delete_images(question.question_image_path, question.options_image_path, keep)
+    
+    def delete_images(self, question_image_path, options_image_path, keep=()):
+        """Delete a question's image files by name, except filenames listed in keep"""
         try:
-            if question.question_image_path:
-                filepath = os.path.join(self.images_dir, question.question_image_path)
+            if question_image_path and question_image_path not in keep:
+                filepath = os.path.join(self.images_dir, question_image_path)
                 if os.path.exists(filepath):
                     os.remove(filepath)
             
-            if question.options_image_path:
-                filepath = os.path.join(self.images_dir, question.options_image_path)
+            if options_image_path and options_image_path not in keep:
+                filepath = os.path.join(self.images_dir, options_image_path)
                 if os.path.exists(filepath):
                     os.remove(filepath)
+                self.release_render(options_image_path)
                     
             return True
         except Exception as e:
-            print(f"Error deleting images: {e}")
+            logger.error(f"Error deleting images: {e}")
             return False
     
     def get_image_url(self, filename):
         """Get the URL for accessing an image"""
         if filename:
-            return f"/api/images/{filename}"
+            return self.image_url_prefix + filename
         return None
 
@@ -1,141 +1,178 @@
 import random
-import hashlib
-from typing import List, Dict, Any
+from functools import lru_cache
+from itertools import permutations
+from typing import List, Dict, Any, Tuple
 
-class RandomizationService:
-    """Service for randomizing quiz questions and options to prevent cheating"""
+MASK_64 = (1 << 64) - 1
+
+def seed_for(user_id: int, quiz_id: int, question_id: int = 0) -> int:
+    """32-bit seed derived from the given ids; only needs to be stable, not secure"""
+    # SplitMix64-style mixing: a few integer ops, no string building or hashing
+    x = (user_id * 0x9E3779B97F4A7C15 ^ quiz_id * 0xBF58476D1CE4E5B9 ^ question_id * 0x94D049BB133111EB) & MASK_64
+    x ^= x >> 30
+    x = (x * 0xBF58476D1CE4E5B9) & MASK_64
+    x ^= x >> 27
+    return x & 0xFFFFFFFF
+
+# Every ordering of up to four options, so shuffling a question's options is one bounded draw
+OPTION_ORDERS = {count: tuple(permutations(range(count))) for count in range(5)}
+
+def shuffle_options(items: List[Any], rng: random.Random) -> List[Any]:
+    """items (at most four) in a random order, chosen with a single rng draw instead of a swap per item"""
+    return [items[i] for i in rng.choice(OPTION_ORDERS[len(items)])]
+
+@lru_cache(maxsize=4096)
+def question_mapping(user_id: int, quiz_id: int, question_id: int) -> Tuple[Tuple[str, str], ...]:
+    """(original, displayed) option key pairs for a user's question; deterministic in the three ids"""
+    option_keys = ['a', 'b', 'c', 'd']
+    shuffled_keys = shuffle_options(option_keys, random.Random(seed_for(user_id, quiz_id, question_id)))
+    
+    # Original key -> the key it is shown under, like randomize_options' option_mapping
+    return tuple(zip(shuffled_keys, option_keys))
+
+def generate_user_seed(user_id: int, quiz_id: int) -> int:
+    """Generate a consistent seed for a user-quiz combination"""
+    # Create a consistent seed based on user and quiz IDs
+    return seed_for(user_id, quiz_id)
+
+def question_order(count: int, user_id: int, quiz_id: int) -> List[int]:
+    """Indices of a user's questions in randomized order"""
+    # Use consistent seed for this user-quiz combination
+    seed = generate_user_seed(user_id, quiz_id)
     
-    def __init__(self):
-        pass
-    
-    def generate_user_seed(self, user_id: int, quiz_id: int) -> int:
-        """Generate a consistent seed for a user-quiz combination"""
-        # Create a consistent seed based on user and quiz IDs
-        seed_string = f"{user_id}_{quiz_id}"
-        hash_object = hashlib.md5(seed_string.encode())
-        # Convert first 8 characters of hash to integer
-        return int(hash_object.hexdigest()[:8], 16)
-    
-    def randomize_questions(self, questions: List[Dict[Any, Any]], user_id: int, quiz_id: int) -> List[Dict[Any, Any]]:
-        """Randomize the order of questions for a specific user"""
-        if not questions:
-            return questions
-        
-        # Use consistent seed for this user-quiz combination
-        seed = self.generate_user_seed(user_id, quiz_id)
-        random.seed(seed)
-        
-        # Create a copy and shuffle
-        randomized_questions = questions.copy()
-        random.shuffle(randomized_questions)
-        
-        # Update question order for tracking
-        for i, question in enumerate(randomized_questions):
-            question['randomized_order'] = i
-        
-        return randomized_questions
-    
-    def randomize_options(self, question: Dict[Any, Any], user_id: int, quiz_id: int) -> Dict[Any, Any]:
-        """Randomize the order of options for a specific question and user"""
-        if not question or 'options' not in question:
-            return question
-        
-        # Use consistent seed based on user, quiz, and question
-        seed_string = f"{user_id}_{quiz_id}_{question.get('id', 0)}"
-        hash_object = hashlib.md5(seed_string.encode())
-        seed = int(hash_object.hexdigest()[:8], 16)
-        random.seed(seed)
-        
-        # Get original options
-        original_options = question['options']
-        option_keys = ['a', 'b', 'c', 'd']
-        
-        # Create list of (key, value) pairs
-        option_pairs = [(key, original_options.get(key, '')) for key in option_keys if original_options.get(key)]
-        
-        # Shuffle the values while keeping track of the mapping
-        option_values = [pair[1] for pair in option_pairs]
-        random.shuffle(option_values)
-        
-        # Create new options mapping
-        new_options = {}
-        correct_answer_mapping = {}
-        
-        for i, key in enumerate(option_keys[:len(option_values)]):
-            new_options[key] = option_values[i]
-            # Find which original key had this value
-            for orig_key, orig_value in option_pairs:
-                if orig_value == option_values[i]:
-                    correct_answer_mapping[orig_key] = key
-                    break
-        
-        # Update the question
+    # Order by random keys from a private generator (the global one is shared across threads);
+    # the C sort beats shuffle()'s per-swap Python loop on long quizzes
+    rng = random.Random(seed)
+    sort_keys = [rng.random() for _ in range(count)]
+    return sorted(range(count), key=sort_keys.__getitem__)
+
+def randomize_questions(questions: List[Dict[Any, Any]], user_id: int, quiz_id: int) -> List[Dict[Any, Any]]:
+    """Randomize the order of questions for a specific user"""
+    if not questions:
+        return questions
+    
+    # Build the new list, recording question order for tracking
+    randomized_questions = []
+    for i, index in enumerate(question_order(len(questions), user_id, quiz_id)):
+        question = questions[index]
+        question['randomized_order'] = i
+        randomized_questions.append(question)
+    
+    return randomized_questions
+
+def randomize_options(question: Dict[Any, Any], user_id: int, quiz_id: int) -> Dict[Any, Any]:
+    """Randomize the order of options for a specific question and user"""
+    if not question or 'options' not in question:
+        return question
+    
+    # Get original options
+    original_options = question['options']
+    option_keys = ['a', 'b', 'c', 'd']
+    # One lookup per key: the filled options as (key, value) pairs
+    option_pairs = [(key, value) for key in option_keys if (value := original_options.get(key))]
+    
+    if len(option_pairs) <= 1:
+        # Zero or one option has a single ordering: leave the options where they are
         randomized_question = question.copy()
-        randomized_question['options'] = new_options
-        
-        # Update correct answer mapping
-        if 'correct_answer' in question:
-            original_correct = question['correct_answer']
-            randomized_question['correct_answer'] = correct_answer_mapping.get(original_correct, original_correct)
-        
-        # Store the mapping for answer verification
-        randomized_question['option_mapping'] = correct_answer_mapping
-        
+        randomized_question['option_mapping'] = {key: key for key, _ in option_pairs}
+        randomized_question['option_mapping_inverse'] = {key: key for key, _ in option_pairs}
         return randomized_question
     
-    def get_randomized_quiz(self, quiz_data: Dict[Any, Any], user_id: int) -> Dict[Any, Any]:
-        """Get a fully randomized quiz for a specific user"""
-        if not quiz_data or 'questions' not in quiz_data:
-            return quiz_data
-        
-        quiz_id = quiz_data.get('id', 0)
-        randomized_quiz = quiz_data.copy()
-        
-        # Randomize questions if enabled
-        if quiz_data.get('randomize_questions', False):
-            randomized_quiz['questions'] = self.randomize_questions(
-                quiz_data['questions'], user_id, quiz_id
-            )
-        
-        # Randomize options if enabled
-        if quiz_data.get('randomize_options', False):
-            for i, question in enumerate(randomized_quiz['questions']):
-                randomized_quiz['questions'][i] = self.randomize_options(
-                    question, user_id, quiz_id
-                )
-        
+    # Use consistent seed based on user, quiz, and question, so each question's order stands
+    # on its own: editing one question never reshuffles another
+    rng = random.Random(seed_for(user_id, quiz_id, question.get('id', 0)))
+    
+    # Shuffle the pairs; each value travels with its key, so no reverse lookup and no second read
+    shuffled_pairs = shuffle_options(option_pairs, rng)
+    
+    # Create new options mapping in one pass
+    new_options = {}
+    correct_answer_mapping = {}
+    inverse_mapping = {}
+    
+    for new_key, (orig_key, value) in zip(option_keys, shuffled_pairs):
+        new_options[new_key] = value
+        correct_answer_mapping[orig_key] = new_key
+        inverse_mapping[new_key] = orig_key
+    
+    # Update the question
+    randomized_question = question.copy()
+    randomized_question['options'] = new_options
+    
+    # Update correct answer mapping
+    if 'correct_answer' in question:
+        original_correct = question['correct_answer']
+        randomized_question['correct_answer'] = correct_answer_mapping.get(original_correct, original_correct)
+    
+    # Store the mapping for answer verification
+    randomized_question['option_mapping'] = correct_answer_mapping
+    randomized_question['option_mapping_inverse'] = inverse_mapping
+    
+    return randomized_question
+
+def get_randomized_quiz(quiz_data: Dict[Any, Any], user_id: int) -> Dict[Any, Any]:
+    """Get a fully randomized quiz for a specific user"""
+    if not quiz_data or 'questions' not in quiz_data:
+        return quiz_data
+    
+    order_questions = quiz_data.get('randomize_questions', False)
+    order_options = quiz_data.get('randomize_options', False)
+    if not order_questions and not order_options:
+        # Nothing to randomize: hand back the caller's dict rather than a copy of it
+        return quiz_data
+    
+    quiz_id = quiz_data.get('id', 0)
+    questions = quiz_data['questions']
+    randomized_quiz = quiz_data.copy()
+    
+    if not order_questions:
+        # Options only: read the caller's list in place; the question dicts are shared until shuffled
+        randomized_quiz['questions'] = [randomize_options(question, user_id, quiz_id) for question in questions]
         return randomized_quiz
     
-    def verify_answer(self, question: Dict[Any, Any], user_answer: str, original_correct: str) -> bool:
-        """Verify if the user's answer is correct, accounting for randomization"""
-        # If there's an option mapping, use it to translate the answer
-        if 'option_mapping' in question:
-            option_mapping = question['option_mapping']
-            # Reverse the mapping to find original answer
-            reverse_mapping = {v: k for k, v in option_mapping.items()}
-            original_user_answer = reverse_mapping.get(user_answer, user_answer)
-            return original_user_answer == original_correct
-        
-        # No randomization, direct comparison
-        return user_answer == original_correct
-    
-    def get_question_mapping(self, user_id: int, quiz_id: int, question_id: int) -> Dict[str, str]:
-        """Get the option mapping for a specific question and user"""
-        # This would typically be stored in the database for the session
-        # For now, we'll regenerate it (consistent due to seeding)
-        seed_string = f"{user_id}_{quiz_id}_{question_id}"
-        hash_object = hashlib.md5(seed_string.encode())
-        seed = int(hash_object.hexdigest()[:8], 16)
-        random.seed(seed)
-        
-        option_keys = ['a', 'b', 'c', 'd']
-        shuffled_keys = option_keys.copy()
-        random.shuffle(shuffled_keys)
-        
-        # Create mapping from original to randomized
-        mapping = {}
-        for i, original_key in enumerate(option_keys):
-            mapping[original_key] = shuffled_keys[i]
-        
-        return mapping
+    # Question order comes first, so a single pass can place each question and shuffle its options
+    order = question_order(len(questions), user_id, quiz_id)
+    
+    randomized_questions = []
+    for i, index in enumerate(order):
+        question = questions[index]
+        if order_options:
+            question = randomize_options(question, user_id, quiz_id)
+        question['randomized_order'] = i
+        randomized_questions.append(question)
+    randomized_quiz['questions'] = randomized_questions
+    
+    return randomized_quiz
+
+def verify_answer(question: Dict[Any, Any], user_answer: str, original_correct: str) -> bool:
+    """Verify if the user's answer is correct, accounting for randomization"""
+    # If there's an option mapping, use it to translate the answer
+    if 'option_mapping' in question:
+        # Reverse mapping to find the original answer; randomize_options stores it precomputed
+        reverse_mapping = question.get('option_mapping_inverse')
+        if reverse_mapping is None:
+            reverse_mapping = {v: k for k, v in question['option_mapping'].items()}
+        original_user_answer = reverse_mapping.get(user_answer, user_answer)
+        return original_user_answer == original_correct
+    
+    # No randomization, direct comparison
+    return user_answer == original_correct
 
+def get_question_mapping(user_id: int, quiz_id: int, question_id: int) -> Dict[str, str]:
+    """Get the option mapping for a specific question and user"""
+    # This would typically be stored in the database for the session
+    # For now, we'll regenerate it from the seed randomize_options uses (same result for a four-option
+    # question); deterministic in the ids, so safe to memoize
+    return dict(question_mapping(user_id, quiz_id, question_id))
+
+class RandomizationService:
+    """Service for randomizing quiz questions and options to prevent cheating"""
+    
+    # Kept for callers of the class interface; the module-level functions above do the work
+    generate_user_seed = staticmethod(generate_user_seed)
+    question_order = staticmethod(question_order)
+    randomize_questions = staticmethod(randomize_questions)
+    randomize_options = staticmethod(randomize_options)
+    get_randomized_quiz = staticmethod(get_randomized_quiz)
+    verify_answer = staticmethod(verify_answer)
+    get_question_mapping = staticmethod(get_question_mapping)
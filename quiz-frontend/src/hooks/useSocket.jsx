@@ -20,7 +20,7 @@ export function useSocket() {
       auth: {
         token: token
       },
-      transports: ['websocket', 'polling']
+      transports: ['websocket']
     })
 
     const socket = socketRef.current
@@ -88,6 +88,7 @@ export function useQuizSocket(sessionToken) {
   const { socket, isConnected, error, emit, on, off } = useSocket()
   const [quizState, setQuizState] = useState({
     timeRemaining: null,
+    quizDuration: null,
     currentQuestionIndex: 0,
     totalQuestions: 0,
     isJoined: false
@@ -99,15 +100,20 @@ export function useQuizSocket(sessionToken) {
       return
     }
 
+    // Session end as a server epoch, set on join and time_sync
+    let endTime = null
+
     // Join quiz session
     emit('join_quiz', { session_token: sessionToken })
 
     // Quiz event handlers
     const handleQuizJoined = (data) => {
       console.log('Joined quiz:', data)
+      endTime = data.end_time
       setQuizState(prev => ({
         ...prev,
         timeRemaining: data.time_remaining,
+        quizDuration: data.quiz_duration,
         currentQuestionIndex: data.current_question_index,
         totalQuestions: data.total_questions,
         isJoined: true
@@ -115,12 +121,23 @@ export function useQuizSocket(sessionToken) {
     }
 
     const handleTimeSync = (data) => {
+      endTime = data.end_time
       setQuizState(prev => ({
         ...prev,
         timeRemaining: data.time_remaining
       }))
     }
 
+    // Server-pushed tick: float64 server epoch (little-endian); the remainder is ours to compute
+    const handleTimeTick = (buffer) => {
+      if (endTime === null) return
+      const serverTime = new DataView(buffer).getFloat64(0, true)
+      setQuizState(prev => ({
+        ...prev,
+        timeRemaining: Math.max(0, Math.floor(endTime - serverTime))
+      }))
+    }
+
     const handleQuestionChanged = (data) => {
       setQuizState(prev => ({
         ...prev,
@@ -153,6 +170,7 @@ export function useQuizSocket(sessionToken) {
     // Register event listeners
     on('quiz_joined', handleQuizJoined)
     on('time_sync', handleTimeSync)
+    on('ts', handleTimeTick)
     on('question_changed', handleQuestionChanged)
     on('answer_submitted', handleAnswerSubmitted)
     on('quiz_completed', handleQuizCompleted)
@@ -163,6 +181,7 @@ export function useQuizSocket(sessionToken) {
     return () => {
       off('quiz_joined', handleQuizJoined)
       off('time_sync', handleTimeSync)
+      off('ts', handleTimeTick)
       off('question_changed', handleQuestionChanged)
       off('answer_submitted', handleAnswerSubmitted)
       off('quiz_completed', handleQuizCompleted)
@@ -175,19 +194,6 @@ export function useQuizSocket(sessionToken) {
     }
   }, [socket, isConnected, sessionToken])
 
-  // Auto time sync every 30 seconds
-  useEffect(() => {
-    if (!socket || !isConnected || !quizState.isJoined) {
-      return
-    }
-
-    const interval = setInterval(() => {
-      emit('request_time_sync')
-    }, 30000)
-
-    return () => clearInterval(interval)
-  }, [socket, isConnected, quizState.isJoined])
-
   const submitAnswer = (questionId, selectedAnswer, timeTaken) => {
     emit('submit_answer', {
       question_id: questionId,
@@ -30,7 +30,7 @@ function DashboardPage() {
   const loadQuizzes = async () => {
     try {
       setLoading(true)
-      const response = await apiCall('/quizzes')
+      const response = await apiCall('/quizzes?per_page=100')
       setQuizzes(response.data)
     } catch (err) {
       setError('Failed to load quizzes. Please try again.')